@@ -103,14 +103,10 @@ def plot_autocorr(
         axes = ax
 
     axes = np.atleast_2d(axes)  # in case of only 1 plot
-    for (var_name, selection, x), ax_ in zip(plotters, axes.flatten()):
-        x_prime = x
-
-        if combined:
-            x_prime = x.flatten()
-
-        y = autocorr(x_prime)
-
+    # all the series have the same length, compute their autocorrelations at once
+    series = np.array([x.flatten() for *_, x in plotters])
+    y_all = autocorr(series, axis=-1, max_lag=max_lag - 1) if plotters else series
+    for (var_name, selection, _), y, ax_ in zip(plotters, y_all, axes.flatten()):
         ax_.vlines(x=np.arange(0, max_lag), ymin=0, ymax=y[0:max_lag], lw=linewidth)
         ax_.hlines(0, 0, max_lag, "steelblue")
         ax_.set_title(make_label(var_name, selection), fontsize=titlesize, wrap=True)
@@ -4,7 +4,7 @@ import numpy as np
 from scipy.stats import mode
 
 from ..data import convert_to_dataset
-from ..stats import hpd
+from ..stats import hpd, QuantileSketch
 from .kdeplot import plot_kde, _fast_kde
 from .plot_utils import (
     xarray_var_iter,
@@ -32,6 +32,7 @@ def plot_posterior(
     bw=4.5,
     bins=None,
     ax=None,
+    method="exact",
     **kwargs
 ):
     """Plot Posterior densities in the style of John K. Kruschke's book.
@@ -75,6 +76,10 @@ def plot_posterior(
         `range(xmin, xmax + 1)` for discrete variables.
     ax : axes
         Matplotlib axes. Defaults to None.
+    method : {"exact", "approx"}
+        How the HPD interval and the median are computed. "approx" estimates them with a
+        `QuantileSketch` instead of sorting all the draws, which is faster for very long chains.
+        Defaults to "exact".
     **kwargs
         Passed as-is to plt.hist() or plt.plot() function depending on the value of `kind`.
 
@@ -144,6 +149,9 @@ def plot_posterior(
 
         >>> az.plot_posterior(data, var_names=['mu'], credible_interval=.75)
     """
+    if method not in ("exact", "approx"):
+        raise ValueError("Method should be in ('exact', 'approx')")
+
     data = convert_to_dataset(data, group="posterior")
     var_names = _var_names(var_names, data)
 
@@ -180,6 +188,7 @@ def plot_posterior(
             rope=rope,
             ax_labelsize=ax_labelsize,
             xt_labelsize=xt_labelsize,
+            method=method,
             **kwargs
         )
 
@@ -204,9 +213,11 @@ def _plot_posterior_op(
     rope,
     ax_labelsize,
     xt_labelsize,
+    method,
     **kwargs
 ):  # noqa: D202
     """Artist to draw posterior."""
+    sketch = QuantileSketch().update(values) if method == "approx" else None
 
     def format_as_percent(x, round_to=0):
         return "{0:.{1:d}f}%".format(100 * x, round_to)
@@ -297,7 +308,7 @@ def _plot_posterior_op(
             else:
                 point_value = mode(values.round(round_to))[0][0]
         elif point_estimate == "median":
-            point_value = np.median(values)
+            point_value = np.median(values) if sketch is None else float(sketch.quantile(0.5))
         point_text = "{}={:.{}f}".format(point_estimate, point_value, round_to)
 
         ax.text(
@@ -309,7 +320,10 @@ def _plot_posterior_op(
         )
 
     def display_hpd():
-        hpd_intervals = hpd(values, credible_interval=credible_interval)
+        if sketch is None:
+            hpd_intervals = hpd(values, credible_interval=credible_interval)
+        else:
+            hpd_intervals = sketch.hpd(credible_interval=credible_interval)
         ax.plot(
             hpd_intervals,
             (plot_height * 0.02, plot_height * 0.02),
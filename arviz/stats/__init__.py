@@ -2,6 +2,8 @@
 """Statistical tests and diagnostics for ArviZ."""
 from .stats import *
 from .diagnostics import *
+from .cache import *
+from .sketch import *
 
 
 __all__ = [
@@ -9,12 +11,22 @@ __all__ = [
     "compare",
     "hpd",
     "loo",
+    "loo_subsample",
     "psislw",
     "r2_score",
     "summary",
     "waic",
+    "diagnose_many",
+    "IncrementalSummary",
     "effective_sample_size",
     "rhat",
     "geweke",
     "autocorr",
+    "rank_diagnostics",
+    "ConvergenceMonitor",
+    "PartialDiagnostics",
+    "QuantileSketch",
+    "enable_cache",
+    "disable_cache",
+    "clear_cache",
 ]
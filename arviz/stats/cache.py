@@ -0,0 +1,180 @@
+"""Opt-in memoization of expensive stats and diagnostics results."""
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+
+import numpy as np
+import xarray as xr
+
+from ..data import InferenceData
+
+__all__ = ["enable_cache", "disable_cache", "clear_cache"]
+
+_CACHE = {"store": None}
+_LOCAL = threading.local()
+
+
+class _ResultStore:
+    """LRU store of results in memory, optionally backed by pickle files in a directory."""
+
+    def __init__(self, maxsize, path):
+        self.maxsize = maxsize
+        self.path = path
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return True, self.results[key]
+        if self.path is not None:
+            try:
+                with open(os.path.join(self.path, key + ".pkl"), "rb") as cache_file:
+                    result = pickle.load(cache_file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return False, None
+            self._add(key, result)
+            return True, result
+        return False, None
+
+    def put(self, key, result):
+        self._add(key, result)
+        if self.path is not None:
+            filename = os.path.join(self.path, key + ".pkl")
+            tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+            with open(tmp_filename, "wb") as cache_file:
+                pickle.dump(result, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, filename)
+
+    def _add(self, key, result):
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+        if self.path is not None:
+            for filename in os.listdir(self.path):
+                if filename.endswith(".pkl"):
+                    os.remove(os.path.join(self.path, filename))
+
+
+def enable_cache(maxsize=128, path=None):
+    """Cache the results of `summary`, `loo`, `waic` and `effective_sample_size`.
+
+    Results are keyed by a fingerprint of the contents of the input data and of the call
+    arguments, so calling one of these functions again on the same data returns the stored
+    result instead of recomputing it, even if the data was reloaded from disk in between.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of results kept in memory, the least recently used ones are dropped
+        first. Defaults to 128.
+    path : str, optional
+        Directory where results are also pickled, so they persist across sessions and can be
+        shared between processes. Defaults to None, results are only kept in memory.
+
+    Notes
+    -----
+    The fingerprint hashes every array of the data, which costs a fraction of the time the
+    cached functions need to process it. Inputs other than numpy arrays, xarray objects and
+    InferenceData, or calls with functions as arguments (like `stat_funcs` in `summary`), are
+    never cached. Dask backed arrays are identified by their dask graph name.
+    """
+    maxsize = int(maxsize)
+    if maxsize < 1:
+        raise ValueError("maxsize must be a positive integer.")
+    _CACHE["store"] = _ResultStore(maxsize, None if path is None else str(path))
+
+
+def disable_cache():
+    """Stop caching results, the results already cached are dropped from memory."""
+    _CACHE["store"] = None
+
+
+def clear_cache():
+    """Drop all the cached results, including the ones persisted on disk."""
+    store = _CACHE["store"]
+    if store is not None:
+        store.clear()
+
+
+def cached(func):
+    """Consult the result cache, if enabled with `enable_cache`, before calling `func`."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        store = _CACHE["store"]
+        # results computed inside another cached call are not cached on their own
+        if store is None or getattr(_LOCAL, "computing", False):
+            return func(*args, **kwargs)
+        try:
+            key = _fingerprint((func.__module__, func.__qualname__, args, sorted(kwargs.items())))
+        except TypeError:
+            return func(*args, **kwargs)
+
+        found, result = store.get(key)
+        if not found:
+            _LOCAL.computing = True
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _LOCAL.computing = False
+            store.put(key, deepcopy(result))
+        return deepcopy(result)
+
+    return wrapper
+
+
+def _fingerprint(obj):
+    """Hash the contents of an object, raising TypeError if it can not be fingerprinted."""
+    hasher = hashlib.blake2b(digest_size=20)
+    _update_hash(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, obj):
+    hasher.update(type(obj).__name__.encode())
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        hasher.update(repr(obj).encode())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(str(len(obj)).encode())
+        for item in obj:
+            _update_hash(hasher, item)
+    elif isinstance(obj, dict):
+        _update_hash(hasher, sorted(obj.items(), key=lambda item: repr(item[0])))
+    elif isinstance(obj, np.ndarray):
+        hasher.update("{}{}".format(obj.dtype.str, obj.shape).encode())
+        if obj.dtype.hasobject:
+            # like string coordinates, the items are fingerprinted one by one
+            _update_hash(hasher, obj.ravel().tolist())
+        else:
+            hasher.update(np.ascontiguousarray(obj).reshape(-1).view(np.uint8))
+    elif isinstance(obj, xr.DataArray):
+        _update_hash(hasher, obj.dims)
+        data = obj.variable.data
+        if hasattr(data, "dask"):
+            # dask graph names are a hash of the computation that produces the array
+            _update_hash(hasher, (data.name, data.shape, data.dtype.str))
+        else:
+            _update_hash(hasher, np.asarray(data))
+        _update_hash(hasher, {name: coord.values for name, coord in obj.coords.items()})
+    elif isinstance(obj, xr.Dataset):
+        _update_hash(hasher, {name: obj[name] for name in obj.data_vars})
+        _update_hash(hasher, {name: coord.values for name, coord in obj.coords.items()})
+    elif isinstance(obj, InferenceData):
+        # pylint: disable=protected-access
+        _update_hash(hasher, {group: getattr(obj, group) for group in obj._groups})
+    else:
+        raise TypeError("{} objects can not be fingerprinted.".format(type(obj).__name__))
@@ -1,19 +1,39 @@
+# pylint: disable=too-many-lines
 """Diagnostic functions for ArviZ."""
+import copy
 import warnings
 
 import numpy as np
 import pandas as pd
-from scipy.signal import fftconvolve
+from scipy.fftpack import next_fast_len
+from scipy.special import ndtri
 import xarray as xr
 
 from ..data import convert_to_dataset
 from ..utils import _var_names
+from . import kernels
+from .cache import cached
+from .stats_utils import wrap_xarray_ufunc
 
 
-__all__ = ["effective_sample_size", "rhat", "geweke", "autocorr"]
+__all__ = [
+    "effective_sample_size",
+    "rhat",
+    "geweke",
+    "autocorr",
+    "rank_diagnostics",
+    "ConvergenceMonitor",
+    "PartialDiagnostics",
+]
 
+# maximum lag of the first autocovariance pass in the effective sample size
+_ESS_FIRST_MAX_LAG = 64
+# number of bins of running moments used to split growing chains in halves
+_SPLIT_BINS = 128
 
-def effective_sample_size(data, *, var_names=None):
+
+@cached
+def effective_sample_size(data, *, var_names=None, n_jobs=1, method="classic"):
     r"""Calculate estimate of the effective sample size.
 
     Parameters
@@ -22,9 +42,16 @@ def effective_sample_size(data, *, var_names=None):
         Any object that can be converted to an az.InferenceData object
         Refer to documentation of az.convert_to_dataset for details
         At least 2 posterior chains are needed to compute this diagnostic of one or more
-        stochastic parameters.
+        stochastic parameters. Dask backed posteriors are processed lazily, chunk by chunk.
     var_names : list
       Names of variables to include in the effective_sample_size report
+    n_jobs : int, optional
+      Number of threads used to split the variables and their parameters. -1 uses all the
+      available cores. Defaults to 1.
+    method : {"classic", "bulk", "tail"}
+      "classic" (default) computes the effective sample size of the draws. "bulk" uses
+      rank normalized split chains, and "tail" the minimum of the effective sample sizes of
+      the 5% and 95% quantile indicators of the split chains (Vehtari et al., 2019).
 
     Returns
     -------
@@ -50,15 +77,30 @@ def effective_sample_size(data, *, var_names=None):
     https://mc-stan.org/docs/2_18/reference-manual/effective-sample-size-section.html Section 15.4.2
 
     Gelman et al. BDA (2014) Formula 11.8
+
+    Vehtari et al. (2019) Rank-normalization, folding, and localization: An improved R-hat for
+    assessing convergence of MCMC. https://arxiv.org/abs/1903.08008
     """
-    if isinstance(data, np.ndarray):
+    methods = ("classic", "bulk", "tail")
+    if method not in methods:
+        raise ValueError("Invalid method: '{}'! Options are: {}".format(method, methods))
+    if method != "classic":
+        ufunc = _make_rank_ufunc("ess_" + method)
+    elif isinstance(data, np.ndarray):
         return _get_ess(data)
+    else:
+        ufunc = _ess_ufunc
+
+    if isinstance(data, np.ndarray):
+        if data.ndim != 2:
+            raise TypeError("Effective sample size calculation requires 2 dimensional arrays.")
+        return ufunc(data)[()]
 
     dataset = convert_to_dataset(data, group="posterior")
     var_names = _var_names(var_names, dataset)
 
     dataset = dataset if var_names is None else dataset[var_names]
-    return xr.apply_ufunc(_ess_ufunc, dataset, input_core_dims=(("chain", "draw"),))
+    return wrap_xarray_ufunc(ufunc, dataset, n_jobs=n_jobs)
 
 
 def _ess_ufunc(ary):
@@ -66,11 +108,13 @@ def _ess_ufunc(ary):
 
     This can be used on an xarray Dataset, using
     `xr.apply_ufunc(_ess_ufunc, ..., input_core_dims=(('chain', 'draw'),))
+
+    All the parameters are stacked in a single (params, chain, draw) block, so the
+    autocovariances and the Geyer truncation are computed once for the whole array.
     """
-    target = np.empty(ary.shape[:-2])
-    for idx in np.ndindex(target.shape):
-        target[idx] = _get_ess(ary[idx])
-    return target
+    target_shape = ary.shape[:-2]
+    ary = np.reshape(ary, (-1,) + ary.shape[-2:])
+    return _ess_batched(ary).reshape(target_shape)
 
 
 def _get_ess(sample_array):
@@ -78,94 +122,206 @@ def _get_ess(sample_array):
     shape = sample_array.shape
     if len(shape) != 2:
         raise TypeError("Effective sample size calculation requires 2 dimensional arrays.")
-    n_chain, n_draws = shape
+    ess = _ess_batched(sample_array[np.newaxis])[0]
+    return ess if np.isnan(ess) else int(ess)
+
+
+def _ess_batched(ary):
+    """Compute the effective sample size for a (params, chain, draw) array."""
+    _, n_chain, n_draws = ary.shape
     if n_chain <= 1:
         raise TypeError("Effective sample size calculation requires multiple chains.")
 
-    acov = np.asarray([_autocov(sample_array[chain]) for chain in range(n_chain)])
+    # Geyer's sequence usually stops after a few lags, so the autocovariance is first
+    # computed up to a small lag, and only the parameters whose sequence did not stop
+    # there are recomputed with all the lags.
+    chain_mean = ary.mean(axis=-1, dtype=np.float64)
+    acov = _autocov(ary, axis=-1, max_lag=min(_ESS_FIRST_MAX_LAG, n_draws - 1))
+    ess, truncated = _ess_from_acov(acov, chain_mean, n_draws, return_truncated=True)
+    if truncated.any():
+        acov = _autocov(ary[truncated], axis=-1)
+        ess[truncated] = _ess_from_acov(acov, chain_mean[truncated], n_draws)
+    return ess
+
 
-    chain_mean = sample_array.mean(axis=1)
-    chain_var = acov[:, 0] * n_draws / (n_draws - 1.0)
-    acov_t = acov[:, 1] * n_draws / (n_draws - 1.0)
-    mean_var = np.mean(chain_var)
+def _ess_from_acov(acov, chain_mean, n_draws, return_truncated=False):
+    """Compute the effective sample size from the per chain autocovariances.
+
+    Parameters
+    ----------
+    acov : Numpy array
+        Autocovariances of shape (params, chain, lags). Lags beyond the last one
+        are never used, so the Geyer sequence is truncated there if needed.
+    chain_mean : Numpy array
+        Chain means of shape (params, chain)
+    n_draws : int
+        Number of draws per chain
+    return_truncated : bool, optional
+        Also return whether the Geyer sequence of each parameter was truncated because it
+        did not stop before the last lag in `acov`. Defaults to False.
+
+    Returns
+    -------
+    ess : Numpy array
+        Effective sample size of shape (params,)
+    truncated : Numpy array
+        Boolean array of shape (params,), only if `return_truncated` is True.
+    """
+    n_chain, n_lags = acov.shape[-2:]
+    chain_var = acov[..., 0] * n_draws / (n_draws - 1.0)
+    acov_t = acov[..., 1] * n_draws / (n_draws - 1.0)
+    mean_var = np.mean(chain_var, axis=-1)
     var_plus = mean_var * (n_draws - 1.0) / n_draws
-    var_plus += np.var(chain_mean, ddof=1)
-
-    rho_hat_t = np.zeros(n_draws)
-    rho_hat_even = 1.0
-    rho_hat_t[0] = rho_hat_even
-    rho_hat_odd = 1.0 - (mean_var - np.mean(acov_t)) / var_plus
-    rho_hat_t[1] = rho_hat_odd
-
-    # Geyer's initial positive sequence
-    max_t = 1
-    t = 1
-    while t < (n_draws - 2) and (rho_hat_even + rho_hat_odd) >= 0.0:
-        rho_hat_even = 1.0 - (mean_var - np.mean(acov[:, t + 1])) / var_plus
-        rho_hat_odd = 1.0 - (mean_var - np.mean(acov[:, t + 2])) / var_plus
-        if (rho_hat_even + rho_hat_odd) >= 0:
-            rho_hat_t[t + 1] = rho_hat_even
-            rho_hat_t[t + 2] = rho_hat_odd
-        max_t = t + 2
-        t += 2
-
-    # Geyer's initial monotone sequence
-    t = 3
-    while t <= max_t - 2:
-        if (rho_hat_t[t + 1] + rho_hat_t[t + 2]) > (rho_hat_t[t - 1] + rho_hat_t[t]):
-            rho_hat_t[t + 1] = (rho_hat_t[t - 1] + rho_hat_t[t]) / 2.0
-            rho_hat_t[t + 2] = rho_hat_t[t + 1]
-        t += 2
-    ess = (
-        int((n_chain * n_draws) / (-1.0 + 2.0 * np.sum(rho_hat_t)))
-        if not np.any(np.isnan(rho_hat_t))
-        else np.nan
-    )
+    if n_chain > 1:
+        var_plus += np.var(chain_mean, axis=-1, ddof=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rho_hat_odd = 1.0 - (mean_var - np.mean(acov_t, axis=-1)) / var_plus
+
+    # Geyer's initial positive sequence: sums of consecutive (even, odd) pairs,
+    # starting at (rho_2, rho_3), preceded by the (rho_0, rho_1) pair.
+    n_pairs = max((n_lags - 2) // 2, 0)
+    if kernels.NUMBA_AVAILABLE:
+        pair_sum, first_negative = kernels.geyer_pair_sums(acov, mean_var, var_plus, rho_hat_odd)
+    else:
+        pair_sum, first_negative = _geyer_pair_sums(acov, mean_var, var_plus, rho_hat_odd)
+
+    rho_hat_sum = 1.0 + rho_hat_odd + pair_sum
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ess = np.trunc((n_chain * n_draws) / (-1.0 + 2.0 * rho_hat_sum))
+    if return_truncated:
+        return ess, (first_negative > n_pairs) & (n_lags < n_draws)
+    return ess
+
+
+def _ess_up_to_max_lag(acov, chain_mean, n_draws, max_lag):
+    """Effective sample size from autocovariances up to `max_lag`, see `_ess_from_acov`.
+
+    The effective sample size of parameters whose Geyer's sequence did not stop before
+    `max_lag` would be overestimated, it is nan instead and a warning is raised.
+    """
+    ess, truncated = _ess_from_acov(acov, chain_mean, n_draws, return_truncated=True)
+    if truncated.any():
+        warnings.warn(
+            "The autocorrelation of {} of {} parameters did not vanish within max_lag={}, "
+            "their effective sample size is nan. Increase max_lag to estimate "
+            "it.".format(np.sum(truncated), truncated.size, max_lag)
+        )
+        ess[truncated] = np.nan
     return ess
 
 
-def autocorr(x):
-    """Compute autocorrelation using FFT for every lag for the input array.
+def _geyer_pair_sums(acov, mean_var, var_plus, rho_hat_odd):
+    """Sum Geyer's initial monotone sequence of pairs, NumPy version of the compiled kernel."""
+    n_lags = acov.shape[-1]
+    n_pairs = max((n_lags - 2) // 2, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_acov = np.mean(acov[..., 2 : 2 + 2 * n_pairs], axis=-2)
+        rho_hat_t = 1.0 - (mean_var[:, None] - mean_acov) / var_plus[:, None]
+    pair_sums = rho_hat_t[:, ::2] + rho_hat_t[:, 1::2]
+    pair_sums = np.concatenate(((1.0 + rho_hat_odd)[:, None], pair_sums), axis=1)
+
+    # the sequence stops at the first pair whose sum is negative (or nan), that pair is
+    # not part of the estimate
+    negative = ~(pair_sums >= 0)
+    first_negative = np.where(negative.any(axis=1), negative.argmax(axis=1), n_pairs + 1)
+    kept = np.arange(1, n_pairs + 1) < first_negative[:, None]
+
+    # Geyer's initial monotone sequence: each pair sum is bounded by the previous one
+    pair_sums = np.where(kept, pair_sums[:, 1:], 0.0)
+    if n_pairs:
+        pair_sums = np.minimum.accumulate(pair_sums, axis=1)
+    return pair_sums.sum(axis=1), first_negative
+
+
+def autocorr(x, axis=-1, max_lag=None, method="auto"):
+    """Compute autocorrelation for every lag up to `max_lag` for the input array.
 
     See https://en.wikipedia.org/wiki/autocorrelation#Efficient_computation
 
     Parameters
     ----------
     x : Numpy array
-        An array containing MCMC samples
+        An array containing MCMC samples. n-D arrays are treated as a batch of series.
+    axis : int, optional
+        The axis along which the autocorrelation is computed. Defaults to the last one.
+    max_lag : int, optional
+        Maximum lag to compute. Defaults to None, all the lags.
+    method : {"auto", "fft", "direct"}
+        Use a zero padded FFT or a direct sum of lagged products, whose cost grows with
+        `max_lag`. "auto" (default) picks the cheapest one.
 
     Returns
     -------
-    acorr: Numpy array same size as the input array
+    acorr: Numpy array same size as the input array along every axis but `axis`, which
+        has length `max_lag + 1`.
     """
-    y = x - x.mean()
-    len_y = len(y)
-    result = fftconvolve(y, y[::-1])
-    acorr = result[len(result) // 2 :]
-    acorr /= np.arange(len_y, 0, -1)
-    acorr /= acorr[0]
-    return acorr
+    acorr = _autocov(x, axis=axis, max_lag=max_lag, method=method)
+    acorr = np.moveaxis(acorr, axis, -1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        acorr = acorr / acorr[..., :1]
+    return np.moveaxis(acorr, -1, axis)
+
 
+def _autocov(x, axis=-1, max_lag=None, method="auto"):
+    """Compute autocovariance estimates for every lag up to `max_lag` for the input array.
 
-def _autocov(x):
-    """Compute autocovariance estimates for every lag for the input array.
+    The autocovariances of every series along `axis` are computed at once, either with a
+    single zero padded real FFT or with a direct sum of lagged products.
 
     Parameters
     ----------
     x : Numpy array
         An array containing MCMC samples
+    axis : int, optional
+        The axis along which the autocovariance is computed. Defaults to the last one.
+    max_lag : int, optional
+        Maximum lag to compute. Defaults to None, all the lags.
+    method : {"auto", "fft", "direct"}
+        Computation method, "auto" (default) uses the direct sum for small `max_lag`.
 
     Returns
     -------
-    acov: Numpy array same size as the input array
+    acov: Numpy array same size as the input array along every axis but `axis`, which
+        has length `max_lag + 1`.
     """
-    acorr = autocorr(x)
-    varx = np.var(x, ddof=1) * (len(x) - 1) / len(x)
-    acov = acorr * varx
-    return acov
-
-
-def rhat(data, var_names=None):
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    len_x = x.shape[-1]
+    max_lag = len_x - 1 if max_lag is None else min(int(max_lag), len_x - 1)
+    if max_lag < 0:
+        raise ValueError("max_lag must be a non negative integer.")
+    if method == "auto":
+        # empirical crossover between the O(n * max_lag) and O(n * log(n)) methods
+        method = "direct" if max_lag + 1 <= 10 * np.log2(max(len_x, 2)) else "fft"
+    elif method not in ("fft", "direct"):
+        raise ValueError(
+            "Invalid method: '{}'! Options are: 'auto', 'fft', 'direct'".format(method)
+        )
+
+    # float32 draws are centered in float32, sums of products are accumulated in float64
+    dtype = np.result_type(x.dtype, np.float32)
+    y = np.subtract(x, x.mean(axis=-1, keepdims=True, dtype=np.float64), dtype=dtype)
+    if method == "fft":
+        n_fft = next_fast_len(2 * len_x)
+        freq = np.fft.rfft(y, n=n_fft, axis=-1)
+        acov = np.fft.irfft(freq.real ** 2 + freq.imag ** 2, n=n_fft, axis=-1)[..., : max_lag + 1]
+    else:
+        y_rows = y.reshape((-1, len_x))
+        acov = np.empty((len(y_rows), max_lag + 1))
+        # process blocks of series small enough to stay in cache across lags
+        block_size = max(2 ** 18 // max(len_x, 1), 1)
+        for start in range(0, len(y_rows), block_size):
+            block = y_rows[start : start + block_size]
+            for lag in range(max_lag + 1):
+                acov[start : start + block_size, lag] = np.einsum(
+                    "ij,ij->i", block[:, : len_x - lag], block[:, lag:], dtype=np.float64
+                )
+        acov = acov.reshape(y.shape[:-1] + (max_lag + 1,))
+    acov /= np.arange(len_x, len_x - max_lag - 1, -1)
+    return np.moveaxis(acov, -1, axis)
+
+
+def rhat(data, var_names=None, round_to=None, n_jobs=1, method="split"):
     r"""Compute estimate of Split R-hat for a set of traces.
 
     The Split R-hat diagnostic tests for lack of convergence by comparing the variance between
@@ -180,10 +336,20 @@ def rhat(data, var_names=None):
         Any object that can be converted to an az.InferenceData object
         Refer to documentation of az.convert_to_dataset for details
         At least 2 posterior chains are needed to compute this diagnostic of one or more
-        stochastic parameters.
+        stochastic parameters. Dask backed posteriors are processed lazily, chunk by chunk.
         For ndarray: shape = (chain, draw).
     var_names : list
       Names of variables to include in the rhat report
+    round_to : int, optional
+      Number of decimals used to round results. Defaults to None, full precision.
+    n_jobs : int, optional
+      Number of threads used to split the variables and their parameters. -1 uses all the
+      available cores. Defaults to 1.
+    method : {"split", "rank"}
+      "split" (default) computes the split R-hat of the draws. "rank" computes the maximum of
+      the split R-hat of the rank normalized draws and of the rank normalized draws folded
+      around the median, which also detects differences in scale between chains and works
+      for heavy tailed distributions (Vehtari et al., 2019).
 
     Returns
     -------
@@ -206,57 +372,735 @@ def rhat(data, var_names=None):
     Gelman et al. BDA (2014)
     Brooks and Gelman (1998)
     Gelman and Rubin (1992)
+    Vehtari et al. (2019) https://arxiv.org/abs/1903.08008
     """
+    methods = ("split", "rank")
+    if method not in methods:
+        raise ValueError("Invalid method: '{}'! Options are: {}".format(method, methods))
     if isinstance(data, np.ndarray):
-        return _get_split_rhat(data)
+        if method == "split":
+            return _get_split_rhat(data, round_to=round_to)
+        if data.ndim != 2:
+            raise TypeError("R-hat calculation requires 2 dimensional arrays.")
+        r_hat = _make_rank_ufunc("r_hat_rank")(data)[()]
+        return r_hat if round_to is None else round(r_hat, round_to)
 
     dataset = convert_to_dataset(data, group="posterior")
     var_names = _var_names(var_names, dataset)
 
     dataset = dataset if var_names is None else dataset[var_names]
-    return xr.apply_ufunc(_rhat_ufunc, dataset, input_core_dims=(("chain", "draw"),))
+    ufunc = _rhat_ufunc if method == "split" else _make_rank_ufunc("r_hat_rank")
+    r_hat = wrap_xarray_ufunc(ufunc, dataset, n_jobs=n_jobs)
+    return r_hat if round_to is None else r_hat.round(round_to)
 
 
 def _rhat_ufunc(ary):
-    """Ufunc for computing effective sample size.
+    """Ufunc for computing the split R-hat.
 
     This can be used on an xarray Dataset, using
-    `xr.apply_ufunc(_neff_ufunc, ..., input_core_dims=(('chain', 'draw'),))
+    `xr.apply_ufunc(_rhat_ufunc, ..., input_core_dims=(('chain', 'draw'),))
     """
-    target = np.empty(ary.shape[:-2])
-    for idx in np.ndindex(target.shape):
-        target[idx] = _get_split_rhat(ary[idx])
-    return target
+    return _split_rhat(ary)
 
 
-def _get_split_rhat(values, round_to=2):
+def _get_split_rhat(values, round_to=None):
     """Compute the split-rhat for a 2d array."""
     shape = values.shape
     if len(shape) != 2:
-        raise TypeError("Effective sample size calculation requires 2 dimensional arrays.")
-    _, num_samples = shape
+        raise TypeError("R-hat calculation requires 2 dimensional arrays.")
+    split_rhat = _split_rhat(values)[()]
+    return split_rhat if round_to is None else round(split_rhat, round_to)
+
+
+def _split_rhat(values):
+    """Compute the split-rhat over the last two (chain, draw) axes of an array."""
+    num_samples = values.shape[-1]
+    if kernels.NUMBA_AVAILABLE:
+        target_shape = values.shape[:-2]
+        split_chain_mean, split_chain_var = kernels.split_chain_moments(
+            np.reshape(values, (-1,) + values.shape[-2:])
+        )
+        return _rhat_from_split_moments(split_chain_mean, split_chain_var, num_samples).reshape(
+            target_shape
+        )
+
     num_split = num_samples // 2
-    # Calculate split chain mean
-    split_chain_mean1 = np.mean(values[:, :num_split], axis=1)
-    split_chain_mean2 = np.mean(values[:, num_split:], axis=1)
-    split_chain_mean = np.concatenate((split_chain_mean1, split_chain_mean2))
-    # Calculate split chain variance
-    split_chain_var1 = np.var(values[:, :num_split], axis=1, ddof=1)
-    split_chain_var2 = np.var(values[:, num_split:], axis=1, ddof=1)
-    split_chain_var = np.concatenate((split_chain_var1, split_chain_var2))
+    # Calculate split chain mean and variance, reusing the mean for the sum of squares
+    split_chain_mean, split_chain_var = [], []
+    dtype = np.result_type(values.dtype, np.float32)
+    for half in (values[..., :num_split], values[..., num_split:]):
+        mean = half.mean(axis=-1, dtype=np.float64)
+        deviation = np.subtract(half, mean[..., None], dtype=dtype)
+        split_chain_mean.append(mean)
+        split_chain_var.append(
+            np.einsum("...i,...i->...", deviation, deviation, dtype=np.float64)
+            / (half.shape[-1] - 1)
+        )
+    split_chain_mean = np.concatenate(split_chain_mean, axis=-1)
+    split_chain_var = np.concatenate(split_chain_var, axis=-1)
+    return _rhat_from_split_moments(split_chain_mean, split_chain_var, num_samples)
+
+
+def _rhat_from_split_moments(split_chain_mean, split_chain_var, num_samples):
+    """Compute the split-rhat from the means and variances of the split chains."""
     # Calculate between-chain variance
-    between_chain_variance = num_samples / 2 * np.var(split_chain_mean, ddof=1)
+    between_chain_variance = num_samples / 2 * np.var(split_chain_mean, axis=-1, ddof=1)
     # Calculate within-chain variance
-    within_chain_variance = np.mean(split_chain_var)
+    within_chain_variance = np.mean(split_chain_var, axis=-1)
     # Estimate of marginal posterior variance
-    split_rhat = np.sqrt(
-        (between_chain_variance / within_chain_variance + num_samples / 2 - 1) / (num_samples / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        split_rhat = np.sqrt(
+            (between_chain_variance / within_chain_variance + num_samples / 2 - 1)
+            / (num_samples / 2)
+        )
+    return split_rhat
+
+
+def rank_diagnostics(data, var_names=None):
+    r"""Compute the rank normalized R-hat, bulk and tail effective sample sizes at once.
+
+    The draws of each parameter are sorted a single time, and the ranks, their folded
+    version and the quantile indicators used by all three diagnostics are derived from that
+    sort.
+
+    Parameters
+    ----------
+    data : obj
+        Any object that can be converted to an az.InferenceData object
+        Refer to documentation of az.convert_to_dataset for details
+    var_names : list
+      Names of variables to include in the report
+
+    Returns
+    -------
+    xarray.Dataset
+        Diagnostics along a new `metric` dimension, with "r_hat_rank", "ess_bulk" and
+        "ess_tail" coordinates. They match `rhat(..., method="rank")` and
+        `effective_sample_size(..., method="bulk")` or `method="tail"`.
+
+    References
+    ----------
+    Vehtari et al. (2019) https://arxiv.org/abs/1903.08008
+    """
+    dataset = convert_to_dataset(data, group="posterior")
+    var_names = _var_names(var_names, dataset)
+    dataset = dataset if var_names is None else dataset[var_names]
+
+    metrics = ("r_hat_rank", "ess_bulk", "ess_tail")
+    results = xr.apply_ufunc(
+        lambda ary: np.stack(_rank_diagnostics(ary, metrics), axis=-1),
+        dataset,
+        input_core_dims=(("chain", "draw"),),
+        output_core_dims=(("metric",),),
+    )
+    return results.assign_coords(metric=list(metrics))
+
+
+def _make_rank_ufunc(metric):
+    """Make a ufunc computing a single rank based diagnostic over the (chain, draw) axes."""
+
+    def _ufunc(ary):
+        return _rank_diagnostics(ary, (metric,))[0]
+
+    return _ufunc
+
+
+def _rank_diagnostics(ary, metrics):
+    """Compute rank based diagnostics over the last two (chain, draw) axes of an array.
+
+    Parameters
+    ----------
+    ary : Numpy array
+        Draws of shape (..., chain, draw)
+    metrics : sequence of {"r_hat_rank", "ess_bulk", "ess_tail"}
+
+    Returns
+    -------
+    list of Numpy arrays of shape (...), one per metric
+    """
+    target_shape = ary.shape[:-2]
+    ary = np.reshape(ary, (-1,) + ary.shape[-2:])
+    n_params, n_chain, n_draws = ary.shape
+    # split the chains in halves, dropping the middle draw if needed
+    half = n_draws // 2
+    split_shape = (n_params, 2 * n_chain, half)
+    split = np.concatenate((ary[..., :half], ary[..., n_draws - half :]), axis=1)
+    flat = split.reshape((n_params, -1))
+
+    # the only sort, the folded draws and the quantiles are derived from it
+    order = np.argsort(flat, axis=1)
+    sorted_draws = np.take_along_axis(flat, order, axis=1)
+    invalid = np.isnan(sorted_draws[:, -1]) | (half < 2)
+
+    results = []
+    for metric in metrics:
+        if metric == "r_hat_rank":
+            bulk = _z_scale(sorted_draws, order).reshape(split_shape)
+            median = _sorted_quantile(sorted_draws, 0.5)
+            folded = np.abs(sorted_draws - median[:, None])
+            # folded draws are a decreasing then an increasing run, sorted in linear time
+            folded_order = np.argsort(folded, axis=1, kind="stable")
+            folded = _z_scale(
+                np.take_along_axis(folded, folded_order, axis=1),
+                np.take_along_axis(order, folded_order, axis=1),
+            ).reshape(split_shape)
+            result = np.maximum(_rhat_split_chains(bulk), _rhat_split_chains(folded))
+        elif metric == "ess_bulk":
+            result = _ess_batched(_z_scale(sorted_draws, order).reshape(split_shape))
+        elif metric == "ess_tail":
+            result = np.minimum(
+                *(
+                    _ess_batched(
+                        (flat <= _sorted_quantile(sorted_draws, prob)[:, None]).reshape(split_shape)
+                    )
+                    for prob in (0.05, 0.95)
+                )
+            )
+        else:
+            raise ValueError("Invalid metric: '{}'".format(metric))
+        results.append(np.where(invalid, np.nan, result).reshape(target_shape))
+    return results
+
+
+def _z_scale(sorted_draws, order):
+    """Compute the normal scores of the ranks of every sorted row, given its sort order.
+
+    Ties get the average of their ranks.
+    """
+    n_params, size = sorted_draws.shape
+    positions = np.broadcast_to(np.arange(size), (n_params, size))
+    run_start = np.ones((n_params, size), dtype=bool)
+    run_start[:, 1:] = sorted_draws[:, 1:] != sorted_draws[:, :-1]
+    run_end = np.ones((n_params, size), dtype=bool)
+    run_end[:, :-1] = run_start[:, 1:]
+    first = np.maximum.accumulate(np.where(run_start, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(run_end, positions, size - 1)[:, ::-1], axis=1)[:, ::-1]
+    sorted_ranks = (first + last) / 2 + 1
+
+    z_scores = np.empty((n_params, size))
+    np.put_along_axis(z_scores, order, ndtri((sorted_ranks - 0.375) / (size + 0.25)), axis=1)
+    return z_scores
+
+
+def _sorted_quantile(sorted_draws, prob):
+    """Linearly interpolated quantile of every sorted row, like np.quantile."""
+    position = prob * (sorted_draws.shape[1] - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, sorted_draws.shape[1] - 1)
+    return sorted_draws[:, lower] + (position - lower) * (
+        sorted_draws[:, upper] - sorted_draws[:, lower]
+    )
+
+
+def _rhat_split_chains(ary):
+    """Compute the R-hat of (params, chain, draw) chains that are already split."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        chain_var = np.var(ary, axis=-1, ddof=1)
+    return _rhat_from_split_moments(ary.mean(axis=-1), chain_var, 2 * ary.shape[-1])
+
+
+class ConvergenceMonitor:
+    """Track split R-hat and effective sample size while draws are being generated.
+
+    Blocks of new draws are appended with `update`, and the diagnostics can be reported
+    at any time with `rhat` and `effective_sample_size`. Both the update and the report
+    cost depend only on the size of the new block and on `max_lag`, not on the number of
+    draws seen so far, so the monitor can be queried often to stop sampling early.
+
+    Parameters
+    ----------
+    max_lag : int, optional
+        Number of autocovariance lags tracked for the effective sample size. It must be larger
+        than the lag at which Geyer's initial sequence stops, i.e. than the autocorrelation
+        time of the chains. Defaults to 100.
+
+    Notes
+    -----
+    Each chain is summarized with running moments of consecutive bins of draws. At most 256
+    bins are kept, adjacent bins are merged when they are all full, so the split R-hat
+    divides the chains at the bin edge closest to their middle, less than 1/256 of the
+    chain away from it. Autocovariances are accumulated as lagged sums of products, using
+    the first and last `max_lag` draws of each chain to center them on the current mean.
+
+    The split R-hat is the same as the one of `rhat` on all the draws whenever half the
+    number of draws is a multiple of the bin size, and the effective sample size is the
+    same as the one of `effective_sample_size` whenever Geyer's sequence stops before
+    `max_lag`. Otherwise, the effective sample size would be overestimated, so it is nan
+    and a warning is raised.
+
+    Examples
+    --------
+    .. code:: ipython
+
+        >>> monitor = az.ConvergenceMonitor(max_lag=200)
+        >>> for block in sampler:
+        ...     monitor.update(block)
+        ...     if (monitor.rhat().max() < 1.01).all():
+        ...         break
+    """
+
+    def __init__(self, max_lag=100):
+        self.max_lag = int(max_lag)
+        self.n_draws = 0
+        self._template = None
+        self._states = None
+
+    def update(self, data):
+        """Append a block of draws to every chain.
+
+        Parameters
+        ----------
+        data : obj
+            Block of new draws. Either a numpy array with shape (chain, draw, *shape) or any
+            object that can be converted to an az.InferenceData object, in which case the
+            posterior group is used. Every chain must get the same number of draws, and the
+            variables, chains and shapes must match the previous blocks.
+        """
+        blocks, template, n_new = _draw_blocks(data)
+        if not n_new:
+            return
+
+        if self._states is None:
+            self._template = template
+            self._states = {
+                var_name: _StreamingChain(ary, self.max_lag) for var_name, ary in blocks.items()
+            }
+        elif set(blocks) != set(self._states):
+            raise ValueError("The variables of the new draws do not match the previous ones.")
+
+        for var_name, ary in blocks.items():
+            self._states[var_name].update(ary)
+        self.n_draws += n_new
+
+    def rhat(self, round_to=None):
+        """Compute the split R-hat of the draws seen so far.
+
+        Parameters
+        ----------
+        round_to : int, optional
+            Number of decimals used to round results. Defaults to None, full precision.
+
+        Returns
+        -------
+        r_hat : xarray.Dataset or numpy array
+        """
+        r_hat = self._report("rhat")
+        return r_hat if round_to is None else r_hat.round(round_to)
+
+    def effective_sample_size(self):
+        """Compute the effective sample size of the draws seen so far.
+
+        Returns
+        -------
+        ess : xarray.Dataset or numpy array
+        """
+        return self._report("effective_sample_size")
+
+    def _report(self, method):
+        if not self._states:
+            raise ValueError("No draws have been added to the monitor yet.")
+        results = {var_name: getattr(state, method)() for var_name, state in self._states.items()}
+        return _format_results(results, self._template)
+
+
+class _StreamingChain:
+    """Running state of the (chain, draw, *shape) draws of one variable."""
+
+    def __init__(self, ary, max_lag):
+        self.n_chain = ary.shape[0]
+        self.shape = ary.shape[2:]
+        # shift common to all chains, it avoids cancellation in the lagged sums of products
+        self.shift = ary.mean(axis=(0, 1))
+        self.bins = _BinnedMoments(self.n_chain, self.shape)
+        self.lags = _LaggedProducts(self.n_chain, self.shape, max_lag + 1)
+
+    @property
+    def count(self):
+        """Number of draws per chain."""
+        return self.bins.count
+
+    def update(self, ary):
+        if ary.shape[0] != self.n_chain or ary.shape[2:] != self.shape:
+            raise ValueError("The shape of the new draws does not match the previous ones.")
+        ary = ary - self.shift
+        self.lags.update(ary)
+        self.bins.update(ary)
+
+    def moments(self):
+        """Per chain count, mean and sum of squared deviations, relative to `shift`."""
+        return self.bins.moments(0, self.bins.n_full, include_partial=True)
+
+    def rhat(self):
+        (half_count, half_mean, half_m2), (other_count, other_mean, other_m2) = self.bins.split()
+        if min(half_count, other_count) < 2:
+            raise ValueError("At least 4 draws per chain are needed to compute the split R-hat.")
+        split_chain_mean = np.concatenate((half_mean, other_mean))
+        split_chain_var = np.concatenate((half_m2 / (half_count - 1), other_m2 / (other_count - 1)))
+        return _rhat_from_split_moments(
+            np.moveaxis(split_chain_mean, 0, -1),
+            np.moveaxis(split_chain_var, 0, -1),
+            half_count + other_count,
+        )
+
+    def effective_sample_size(self, single_chain=False):
+        """Effective sample size, also of a single chain if `single_chain` is True."""
+        if self.n_chain <= 1 and not single_chain:
+            raise TypeError("Effective sample size calculation requires multiple chains.")
+        count, mean, _ = self.moments()
+        acov = self.lags.autocov(count, mean)
+        n_lags = acov.shape[-1]
+        acov = np.moveaxis(acov, 0, -2).reshape((-1, self.n_chain, n_lags))
+        chain_mean = np.moveaxis(mean, 0, -1).reshape((-1, self.n_chain))
+        ess = _ess_up_to_max_lag(acov, chain_mean, count, self.lags.n_lags - 1)
+        return ess.reshape(self.shape)
+
+
+class _LaggedProducts:
+    """Lagged sums of products of growing chains, and their first and last draws."""
+
+    def __init__(self, n_chain, shape, n_lags):
+        self.n_lags = n_lags
+        self.products = np.zeros((n_chain,) + shape + (n_lags,))
+        self.head = np.empty((n_chain, 0) + shape)
+        self.tail = np.empty((n_chain, 0) + shape)
+
+    def update(self, ary):
+        # lagged sums of products of the new draws with the previous max_lag ones
+        extended = np.concatenate((self.tail, ary), axis=1)
+        len_tail, len_extended = self.tail.shape[1], extended.shape[1]
+        for lag in range(min(self.n_lags, len_extended)):
+            start = max(len_tail, lag)
+            self.products[..., lag] += np.sum(
+                extended[:, start:] * extended[:, start - lag : len_extended - lag], axis=1
+            )
+        self.tail = extended[:, -self.n_lags :]
+        if self.head.shape[1] < self.n_lags:
+            self.head = np.concatenate((self.head, ary[:, : self.n_lags - self.head.shape[1]]), 1)
+
+    def autocov(self, count, mean):
+        """Autocovariances of shape (chain, *shape, lags) of chains with `count` draws."""
+        n_lags = min(self.n_lags, count)
+        lags = np.arange(n_lags)
+        # sums of the first and last draws, to center the lagged products on the chain mean
+        head_sums = np.moveaxis(np.cumsum(self.head[:, : n_lags - 1], axis=1), 1, -1)
+        tail_sums = np.moveaxis(np.cumsum(self.tail[:, ::-1][:, : n_lags - 1], axis=1), 1, -1)
+        zeros = np.zeros(head_sums.shape[:-1] + (1,))
+        head_sums = np.concatenate((zeros, head_sums), axis=-1)
+        tail_sums = np.concatenate((zeros, tail_sums), axis=-1)
+
+        mean = mean[..., None]
+        total = count * mean
+        return (
+            self.products[..., :n_lags]
+            - mean * (2 * total - head_sums - tail_sums)
+            + (count - lags) * mean ** 2
+        ) / (count - lags)
+
+
+class _BinnedMoments:
+    """Running moments of consecutive bins of draws of growing chains.
+
+    Full bins all have `bin_size` draws. When `2 * n_bins` of them are stored, adjacent
+    bins are merged, so the memory is bounded and the chain can be split at any multiple
+    of `bin_size` draws, at most `count / (2 * n_bins)` draws away from its middle.
+    """
+
+    def __init__(self, n_chain, shape, n_bins=_SPLIT_BINS):
+        self.n_bins = n_bins
+        self.bin_size = 1
+        self.n_full = 0
+        self.means = np.zeros((2 * n_bins, n_chain) + shape)
+        self.m2s = np.zeros((2 * n_bins, n_chain) + shape)
+        # count, mean and sum of squared deviations of the last bin, not full yet
+        self.partial = (0, 0.0, 0.0)
+
+    @property
+    def count(self):
+        """Number of draws per chain."""
+        return self.n_full * self.bin_size + self.partial[0]
+
+    def update(self, ary):
+        start, n_draws = 0, ary.shape[1]
+        while start < n_draws:
+            n_new = min((n_draws - start) // self.bin_size, 2 * self.n_bins - self.n_full)
+            if self.partial[0] or not n_new:
+                stop = min(n_draws, start + self.bin_size - self.partial[0])
+                self.partial = _merge_moments(*self.partial, *_block_moments(ary[:, start:stop]))
+                if self.partial[0] == self.bin_size:
+                    self.means[self.n_full], self.m2s[self.n_full] = self.partial[1:]
+                    self.n_full += 1
+                    self.partial = (0, 0.0, 0.0)
+            else:
+                # many full bins at once
+                stop = start + n_new * self.bin_size
+                block = ary[:, start:stop].reshape(
+                    (ary.shape[0], n_new, self.bin_size) + ary.shape[2:]
+                )
+                mean = block.mean(axis=2)
+                m2 = np.sum((block - mean[:, :, None]) ** 2, axis=2)
+                self.means[self.n_full : self.n_full + n_new] = np.moveaxis(mean, 1, 0)
+                self.m2s[self.n_full : self.n_full + n_new] = np.moveaxis(m2, 1, 0)
+                self.n_full += n_new
+            start = stop
+            if self.n_full == 2 * self.n_bins:
+                self._coarsen()
+
+    def _coarsen(self):
+        """Merge adjacent full bins, doubling their size."""
+        even, odd = self.means[0::2], self.means[1::2]
+        m2 = self.m2s[0::2] + self.m2s[1::2] + (odd - even) ** 2 * self.bin_size / 2
+        self.means[: self.n_bins] = (even + odd) / 2
+        self.m2s[: self.n_bins] = m2
+        self.n_full = self.n_bins
+        self.bin_size *= 2
+
+    def moments(self, start, stop, include_partial=False):
+        """Pooled count, mean and sum of squared deviations of the full bins [start, stop)."""
+        partial = self.partial if include_partial else (0, 0.0, 0.0)
+        if start == stop:
+            return partial
+        means = self.means[start:stop]
+        count = (stop - start) * self.bin_size
+        mean = means.mean(axis=0)
+        m2 = self.m2s[start:stop].sum(axis=0) + self.bin_size * np.sum((means - mean) ** 2, 0)
+        if partial[0]:
+            return _merge_moments(count, mean, m2, *partial)
+        return count, mean, m2
+
+    def split(self):
+        """Moments of the two halves of the chains, split at the bin edge closest to the middle."""
+        n_first = (self.count // 2 + self.bin_size // 2) // self.bin_size
+        n_first = min(n_first, self.n_full - (0 if self.partial[0] else 1))
+        return (
+            self.moments(0, n_first),
+            self.moments(n_first, self.n_full, include_partial=True),
+        )
+
+
+class PartialDiagnostics:
+    """Sufficient statistics of some chains, to compute R-hat, ESS and MCSE without the draws.
+
+    Each machine running chains summarizes them locally, and a coordinator merges the
+    summaries of all the chains with `merge` before computing the diagnostics. Only
+    O(chain * params * max_lag) numbers need to be moved, instead of all the draws.
+
+    Parameters
+    ----------
+    data : obj
+        Draws of one or more chains. Either a numpy array with shape (chain, draw, *shape) or
+        any object that can be converted to an az.InferenceData object, in which case the
+        posterior group is used.
+    max_lag : int, optional
+        Number of autocovariance lags kept for the effective sample size. It must be larger
+        than the lag at which Geyer's initial sequence stops, i.e. than the autocorrelation
+        time of the chains. Defaults to 100.
+
+    Notes
+    -----
+    Every chain is summarized by its mean, the means and sums of squared deviations of its
+    two halves, and its autocovariances up to `max_lag`. `rhat` gives the same results as
+    the function of the same name on all the draws. So do `effective_sample_size` and
+    `mcse` whenever Geyer's sequence stops before `max_lag`, otherwise the effective sample
+    size would be overestimated, so it is nan and a warning is raised.
+
+    Examples
+    --------
+    .. code:: ipython
+
+        >>> # on every worker
+        >>> partial = az.PartialDiagnostics(draws, max_lag=200)
+        >>> # on the coordinator, with the pickled objects sent by the workers
+        >>> merged = partials[0].merge(*partials[1:])
+        >>> merged.rhat(), merged.effective_sample_size(), merged.mcse()
+    """
+
+    def __init__(self, data, max_lag=100):
+        blocks, template, n_draws = _draw_blocks(data)
+        if n_draws < 4:
+            raise ValueError("At least 4 draws per chain are needed to compute the diagnostics.")
+        self.max_lag = int(max_lag)
+        self.n_draws = n_draws
+        self._template = template
+        self._chains = {
+            var_name: _chain_statistics(ary, self.max_lag) for var_name, ary in blocks.items()
+        }
+
+    @property
+    def n_chains(self):
+        """Number of chains summarized."""
+        return len(next(iter(self._chains.values()))["mean"])
+
+    def merge(self, *others):
+        """Combine the statistics of other chains with the ones of this object.
+
+        Parameters
+        ----------
+        others : PartialDiagnostics
+            Statistics of other chains of the same variables, with the same number of draws
+            and `max_lag`.
+
+        Returns
+        -------
+        PartialDiagnostics
+            New object summarizing all the chains.
+        """
+        # pylint: disable=protected-access
+        for other in others:
+            if (other.n_draws, other.max_lag) != (self.n_draws, self.max_lag):
+                raise ValueError("Only chains with the same n_draws and max_lag can be merged.")
+            if set(other._chains) != set(self._chains):
+                raise ValueError("Only chains of the same variables can be merged.")
+        merged = copy.copy(self)
+        merged._chains = {
+            var_name: {
+                key: np.concatenate([value] + [other._chains[var_name][key] for other in others])
+                for key, value in chains.items()
+            }
+            for var_name, chains in self._chains.items()
+        }
+        return merged
+
+    def rhat(self, round_to=None):
+        """Compute the split R-hat of the merged chains.
+
+        Parameters
+        ----------
+        round_to : int, optional
+            Number of decimals used to round results. Defaults to None, full precision.
+
+        Returns
+        -------
+        r_hat : xarray.Dataset or numpy array
+        """
+        results = {}
+        for var_name, chains in self._chains.items():
+            half_counts = self._half_counts(chains)
+            split_chain_mean = np.concatenate(chains["half_mean"], axis=0)
+            split_chain_var = np.concatenate(chains["half_m2"] / (half_counts - 1), axis=0)
+            results[var_name] = _rhat_from_split_moments(
+                np.moveaxis(split_chain_mean, 0, -1),
+                np.moveaxis(split_chain_var, 0, -1),
+                self.n_draws,
+            )
+        r_hat = _format_results(results, self._template)
+        return r_hat if round_to is None else r_hat.round(round_to)
+
+    def effective_sample_size(self):
+        """Compute the effective sample size of the merged chains.
+
+        Returns
+        -------
+        ess : xarray.Dataset or numpy array
+        """
+        return _format_results(
+            {var_name: self._ess(chains) for var_name, chains in self._chains.items()},
+            self._template,
+        )
+
+    def mcse(self):
+        """Compute the Monte Carlo standard error of the posterior mean of the merged chains.
+
+        The error is estimated as the posterior standard deviation divided by the square root
+        of the effective sample size.
+
+        Returns
+        -------
+        mcse : xarray.Dataset or numpy array
+        """
+        results = {}
+        for var_name, chains in self._chains.items():
+            # pooled variance of the draws from the moments of the chain halves
+            half_counts = self._half_counts(chains)
+            count = len(chains["mean"]) * self.n_draws
+            mean = np.sum(half_counts * chains["half_mean"], axis=(0, 1)) / count
+            m2 = np.sum(chains["half_m2"] + half_counts * (chains["half_mean"] - mean) ** 2, (0, 1))
+            results[var_name] = np.sqrt(m2 / count / self._ess(chains))
+        return _format_results(results, self._template)
+
+    def _half_counts(self, chains):
+        """Count the draws in each chain half, broadcastable against the half moments."""
+        half_count = self.n_draws // 2
+        shape = (1, 2) + (1,) * (chains["half_mean"].ndim - 2)
+        return np.reshape([half_count, self.n_draws - half_count], shape)
+
+    def _ess(self, chains):
+        if len(chains["mean"]) <= 1:
+            raise TypeError("Effective sample size calculation requires multiple chains.")
+        shape = chains["mean"].shape[1:]
+        n_lags = chains["acov"].shape[-1]
+        acov = np.moveaxis(chains["acov"], 0, -2).reshape((-1, len(chains["mean"]), n_lags))
+        chain_mean = np.moveaxis(chains["mean"], 0, -1).reshape((-1, len(chains["mean"])))
+        return _ess_up_to_max_lag(acov, chain_mean, self.n_draws, self.max_lag).reshape(shape)
+
+
+def _chain_statistics(ary, max_lag):
+    """Per chain mean, half moments and autocovariances of a (chain, draw, *shape) array."""
+    half_count = ary.shape[1] // 2
+    half_mean, half_m2 = [], []
+    for half in (ary[:, :half_count], ary[:, half_count:]):
+        _, mean, m2 = _block_moments(half)
+        half_mean.append(mean)
+        half_m2.append(m2)
+    return {
+        "mean": ary.mean(axis=1, dtype=np.float64),
+        "half_mean": np.stack(half_mean, axis=1),
+        "half_m2": np.stack(half_m2, axis=1),
+        "acov": _autocov(np.moveaxis(ary, 1, -1), axis=-1, max_lag=max_lag),
+    }
+
+
+def _draw_blocks(data):
+    """Split draws into (chain, draw, *shape) arrays per variable.
+
+    Returns
+    -------
+    blocks : dict
+        Arrays keyed by variable name, or by None if `data` is a numpy array
+    template : xarray.Dataset or None
+        Dataset without the (chain, draw) dimensions to format the results, None if `data`
+        is a numpy array
+    n_draws : int
+        Number of draws per chain
+    """
+    if isinstance(data, np.ndarray):
+        blocks, template = {None: data}, None
+    else:
+        dataset = convert_to_dataset(data, group="posterior")
+        blocks = {var_name: dataset[var_name].values for var_name in dataset.data_vars}
+        template = dataset.isel(chain=0, draw=0, drop=True)
+
+    n_draws = {ary.shape[1] if ary.ndim > 1 else None for ary in blocks.values()}
+    if len(n_draws) != 1 or None in n_draws:
+        raise TypeError("Draws must have (chain, draw) as their leading dimensions.")
+    return blocks, template, n_draws.pop()
+
+
+def _format_results(results, template):
+    """Return the diagnostics of every variable as a Dataset, or an array without template."""
+    if template is None:
+        return results[None]
+    return xr.Dataset(
+        {var_name: (template[var_name].dims, value) for var_name, value in results.items()},
+        coords=template.coords,
     )
 
-    return round(split_rhat, round_to)
 
+def _block_moments(ary):
+    """Count, mean and sum of squared deviations along the draw axis of a block."""
+    mean = ary.mean(axis=1)
+    return ary.shape[1], mean, np.sum((ary - mean[:, None]) ** 2, axis=1)
+
+
+def _merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """Merge the running moments of two sets of draws (Chan et al. parallel algorithm)."""
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+    return count, mean, m2
 
-def geweke(values, first=0.1, last=0.5, intervals=20):
+
+def geweke(values, first=0.1, last=0.5, intervals=20, *, var_names=None):
     r"""Compute z-scores for convergence diagnostics.
 
     Compare the mean of the first % of series with the mean of the last % of series. x is divided
@@ -265,8 +1109,11 @@ def geweke(values, first=0.1, last=0.5, intervals=20):
 
     Parameters
     ----------
-    values : 1D array-like
-      The trace of some stochastic parameter.
+    values : 1D array-like or obj
+      The trace of some stochastic parameter. Any other object that can be converted to an
+      az.InferenceData object is also accepted, in which case every chain of every variable in
+      the posterior is processed at once. Refer to documentation of az.convert_to_dataset for
+      details.
     first : float
       The fraction of series at the beginning of the trace.
     last : float
@@ -274,12 +1121,16 @@ def geweke(values, first=0.1, last=0.5, intervals=20):
       at the beginning.
     intervals : int
       The number of segments.
+    var_names : list
+      Names of variables to include in the geweke report, only used for non array inputs.
 
     Returns
     -------
-    scores : list [[]]
-      Return a list of [i, score], where i is the starting index for each interval and score the
-      Geweke score on the interval.
+    scores : list [[]] or xarray.Dataset
+      For 1D arrays, return a list of [i, score], where i is the starting index for each
+      interval and score the Geweke score on the interval. Otherwise, return a Dataset with
+      the Geweke scores along a new `interval` dimension, whose coordinate is the starting
+      index of each interval, in place of the `draw` dimension.
 
     Notes
     -----
@@ -291,6 +1142,9 @@ def geweke(values, first=0.1, last=0.5, intervals=20):
     :math:`x_s` a section at the start of the series and
     :math:`x_e` a section at the end of the series.
 
+    The means and variances of all the sections are obtained from the cumulative sums of the
+    series and of its squares, so the cost is linear in the length of the series.
+
     References
     ----------
     Geweke (1992)
@@ -302,11 +1156,37 @@ def geweke(values, first=0.1, last=0.5, intervals=20):
     if first + last >= 1:
         raise ValueError("Invalid intervals for Geweke convergence analysis", (first, last))
 
-    # Initialize list of z-scores
-    zscores = []
+    if isinstance(values, np.ndarray) and values.ndim == 1:
+        start_indices, zscores = _geweke(values, first, last, intervals)
+        return np.column_stack((start_indices, zscores))
+
+    dataset = convert_to_dataset(values, group="posterior")
+    var_names = _var_names(var_names, dataset)
+    dataset = dataset if var_names is None else dataset[var_names]
+
+    start_indices, _ = _geweke(np.zeros(dataset.draw.size), first, last, intervals)
+    zscores = xr.apply_ufunc(
+        lambda ary: _geweke(ary, first, last, intervals)[1],
+        dataset,
+        input_core_dims=(("draw",),),
+        output_core_dims=(("interval",),),
+    )
+    return zscores.assign_coords(interval=start_indices)
+
 
+def _geweke(ary, first, last, intervals):
+    """Compute the Geweke z-scores along the last axis of an array.
+
+    Returns
+    -------
+    start_indices : Numpy array
+        Starting index of each interval
+    zscores : Numpy array
+        Array with the leading shape of `ary` and one z-score per interval
+    """
+    ary = np.asarray(ary, dtype=float)
     # Last index value
-    end = len(values) - 1
+    end = ary.shape[-1] - 1
 
     # Start intervals going up to the <last>% of the chain
     last_start_idx = (1 - last) * end
@@ -314,18 +1194,28 @@ def geweke(values, first=0.1, last=0.5, intervals=20):
     # Calculate starting indices
     start_indices = np.linspace(0, last_start_idx, num=intervals, endpoint=True, dtype=int)
 
-    # Loop over start indices
-    for start in start_indices:
-        # Calculate slices
-        first_slice = values[start : start + int(first * (end - start))]
-        last_slice = values[int(end - last * (end - start)) :]
+    # Calculate slices
+    first_stop = start_indices + (first * (end - start_indices)).astype(int)
+    last_start = (end - last * (end - start_indices)).astype(int)
+
+    # Cumulative sums of the centered series give the mean and variance of every slice
+    centered = ary - ary.mean(axis=-1, keepdims=True)
+    zeros = np.zeros(ary.shape[:-1] + (1,))
+    cumsum = np.concatenate((zeros, np.cumsum(centered, axis=-1)), axis=-1)
+    cumsum_sq = np.concatenate((zeros, np.cumsum(centered ** 2, axis=-1)), axis=-1)
 
-        z_score = first_slice.mean() - last_slice.mean()
-        z_score /= np.sqrt(first_slice.var() + last_slice.var())
+    def slice_moments(start, stop):
+        length = stop - start
+        mean = (cumsum[..., stop] - cumsum[..., start]) / length
+        var = (cumsum_sq[..., stop] - cumsum_sq[..., start]) / length - mean ** 2
+        return mean, np.maximum(var, 0)
 
-        zscores.append([start, z_score])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        first_mean, first_var = slice_moments(start_indices, first_stop)
+        last_mean, last_var = slice_moments(last_start, np.full_like(last_start, end + 1))
+        zscores = (first_mean - last_mean) / np.sqrt(first_var + last_var)
 
-    return np.array(zscores)
+    return start_indices, zscores
 
 
 def ks_summary(pareto_tail_indices):
@@ -0,0 +1,281 @@
+"""Compiled kernels for the inner loops of the diagnostics.
+
+The kernels are compiled in nopython mode with numba if it is installed, the loop over
+parameters (or observations) running in parallel. Without numba, ``NUMBA_AVAILABLE`` is
+False and the callers use their NumPy implementations instead.
+
+Calls made from functions wrapped with `serial` use a serial version of the kernels, so
+that numba parallel regions are never launched concurrently from several threads, which
+aborts the process with numba's default ``workqueue`` threading layer.
+"""
+import functools
+import threading
+
+import numpy as np
+
+from ..utils import conditional_jit
+
+try:
+    from numba import prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    prange = range  # pylint: disable=invalid-name
+    NUMBA_AVAILABLE = False
+
+_EPS = np.finfo(float).eps  # pylint: disable=no-member
+_LOCAL = threading.local()
+
+
+def serial(func):
+    """Make `func` use the serial kernels in the thread calling it, e.g. a thread pool worker."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_LOCAL, "serial", False)
+        _LOCAL.serial = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _LOCAL.serial = previous
+
+    return wrapper
+
+
+def _parallel_kernel(func):
+    """Compile a kernel with a parallel loop, and a serial version used by `serial` callers."""
+    parallel = conditional_jit(nopython=True, parallel=True, cache=True, error_model="numpy")(func)
+    # not cached, the cache of a function does not tell apart the parallel and serial versions
+    serial_kernel = conditional_jit(nopython=True, error_model="numpy")(func)
+
+    @functools.wraps(func)
+    def kernel(*args):
+        if getattr(_LOCAL, "serial", False):
+            return serial_kernel(*args)
+        return parallel(*args)
+
+    return kernel
+
+
+@_parallel_kernel
+def geyer_pair_sums(acov, mean_var, var_plus, rho_hat_odd):
+    """Sum Geyer's initial monotone sequence of autocorrelation pairs.
+
+    Parameters
+    ----------
+    acov : Numpy array
+        Autocovariances of shape (params, chain, lags)
+    mean_var, var_plus, rho_hat_odd : Numpy array
+        Mean within chain variance, pooled variance and lag 1 autocorrelation of shape (params,)
+
+    Returns
+    -------
+    pair_sum : Numpy array
+        Sum of the monotone pair sums after the (rho_0, rho_1) pair, of shape (params,)
+    first_negative : Numpy array
+        Index of the first negative pair, counting (rho_0, rho_1) as 0, or ``n_pairs + 1`` if
+        the sequence did not stop before the last lag.
+    """
+    n_params, n_chain, n_lags = acov.shape
+    n_pairs = max((n_lags - 2) // 2, 0)
+    pair_sum = np.zeros(n_params)
+    first_negative = np.full(n_params, n_pairs + 1)
+    for i in prange(n_params):  # pylint: disable=not-an-iterable
+        if not 1.0 + rho_hat_odd[i] >= 0:
+            first_negative[i] = 0
+            continue
+        total = 0.0
+        previous = np.inf
+        for pair in range(n_pairs):
+            acov_even = 0.0
+            acov_odd = 0.0
+            for chain in range(n_chain):
+                acov_even += acov[i, chain, 2 * pair + 2]
+                acov_odd += acov[i, chain, 2 * pair + 3]
+            rho_hat_even = 1.0 - (mean_var[i] - acov_even / n_chain) / var_plus[i]
+            rho_hat_odd_t = 1.0 - (mean_var[i] - acov_odd / n_chain) / var_plus[i]
+            current = rho_hat_even + rho_hat_odd_t
+            if not current >= 0:
+                first_negative[i] = pair + 1
+                break
+            previous = min(previous, current)
+            total += previous
+        pair_sum[i] = total
+    return pair_sum, first_negative
+
+
+@_parallel_kernel
+def split_chain_moments(values):
+    """Compute the means and variances of the split chains of a (params, chain, draw) array.
+
+    Returns
+    -------
+    split_chain_mean, split_chain_var : Numpy array
+        Arrays of shape (params, 2 * chain), the first halves of all the chains first.
+    """
+    n_params, n_chain, n_draws = values.shape
+    num_split = n_draws // 2
+    split_chain_mean = np.empty((n_params, 2 * n_chain))
+    split_chain_var = np.empty((n_params, 2 * n_chain))
+    for i in prange(n_params):  # pylint: disable=not-an-iterable
+        for half in range(2):
+            start = half * num_split
+            stop = num_split if half == 0 else n_draws
+            for chain in range(n_chain):
+                total = 0.0
+                for j in range(start, stop):
+                    total += values[i, chain, j]
+                mean = total / (stop - start)
+                sum_sq = 0.0
+                for j in range(start, stop):
+                    deviation = values[i, chain, j] - mean
+                    sum_sq += deviation * deviation
+                split_chain_mean[i, half * n_chain + chain] = mean
+                split_chain_var[i, half * n_chain + chain] = sum_sq / (stop - start - 1)
+    return split_chain_mean, split_chain_var
+
+
+@_parallel_kernel
+def batch_means_std(ary, batches):
+    """Compute the standard deviation of the batch means of every row of a 2D array.
+
+    Each row is cut in `batches` consecutive batches of ``len(row) // batches`` draws, the
+    trailing draws are not used.
+    """
+    n_params, len_x = ary.shape
+    batch_len = len_x // batches
+    std = np.empty(n_params)
+    for i in prange(n_params):  # pylint: disable=not-an-iterable
+        means = np.empty(batches)
+        for batch in range(batches):
+            total = 0.0
+            for j in range(batch * batch_len, (batch + 1) * batch_len):
+                total += ary[i, j]
+            means[batch] = total / batch_len
+        std[i] = np.std(means)
+    return std
+
+
+@_parallel_kernel
+def hpd_search(sorted_ary, interval_idx_inc):
+    """Find the narrowest interval spanning `interval_idx_inc` draws of every sorted row.
+
+    Returns
+    -------
+    hpd : Numpy array
+        Lower and upper value of the interval of each row, shape (params, 2).
+    """
+    n_params, len_x = sorted_ary.shape
+    n_intervals = len_x - interval_idx_inc
+    hpd = np.empty((n_params, 2), dtype=sorted_ary.dtype)
+    for i in prange(n_params):  # pylint: disable=not-an-iterable
+        min_idx = 0
+        min_width = np.inf
+        for j in range(n_intervals):
+            width = sorted_ary[i, j + interval_idx_inc] - sorted_ary[i, j]
+            # like np.argmin, nan widths take precedence
+            if np.isnan(width):
+                min_idx = j
+                break
+            if width < min_width:
+                min_idx = j
+                min_width = width
+        hpd[i, 0] = sorted_ary[i, min_idx]
+        hpd[i, 1] = sorted_ary[i, min_idx + interval_idx_inc]
+    return hpd
+
+
+@_parallel_kernel
+def psis_smooth(log_weights, cutoff_ind, cutoffmin, k_min):
+    """Pareto smooth the tail of every row of a (observations, samples) array in place.
+
+    Returns
+    -------
+    kss : Numpy array
+        Pareto tail indices of shape (observations,)
+    """
+    n_obs, len_x = log_weights.shape
+    kss = np.empty(n_obs)
+    for i in prange(n_obs):  # pylint: disable=not-an-iterable
+        x = log_weights[i]
+        # improve numerical accuracy
+        x -= np.max(x)
+        # divide log weights into body and right tail, only the cutoff has to be sorted
+        xcutoff = max(np.partition(x, len_x + cutoff_ind)[len_x + cutoff_ind], cutoffmin)
+        expxcutoff = np.exp(xcutoff)
+        tailinds = np.where(x > xcutoff)[0]
+        tail_len = len(tailinds)
+        k = np.inf
+        if tail_len > 4:
+            x_tail = x[tailinds]
+            x_tail_si = np.argsort(x_tail)
+            # fit generalized Pareto distribution to the right tail samples
+            k, sigma = _gpdfit(np.exp(x_tail[x_tail_si]) - expxcutoff)
+            if k >= k_min:
+                sti = (np.arange(tail_len) + 0.5) / tail_len
+                smoothed_tail = np.log(_gpinv(sti, k, sigma) + expxcutoff)
+                # place the smoothed tail into the output array
+                for j in range(tail_len):
+                    x[tailinds[x_tail_si[j]]] = smoothed_tail[j]
+                # truncate smoothed values to the largest raw weight 0
+                for j in range(len_x):
+                    if x[j] > 0:
+                        x[j] = 0
+        # renormalize weights, accumulating the sum of exponentials in double precision
+        x_max = np.max(x)
+        sum_exp = 0.0
+        for j in range(len_x):
+            sum_exp += np.exp(np.float64(x[j] - x_max))
+        x -= x_max + np.log(sum_exp)
+        kss[i] = k
+    return kss
+
+
+@conditional_jit(nopython=True, cache=True, error_model="numpy")
+def _gpdfit(x):
+    """Estimate the parameters of the Generalized Pareto Distribution, see `stats._gpdfit`."""
+    prior_bs = 3
+    prior_k = 10
+    len_x = len(x)
+    m_est = 30 + int(len_x ** 0.5)
+
+    b_ary = 1 - np.sqrt(m_est / (np.arange(1, m_est + 1) - 0.5))
+    b_ary /= prior_bs * x[int(len_x / 4 + 0.5) - 1]
+    b_ary += 1 / x[-1]
+
+    k_ary = np.zeros(m_est)
+    for i in range(m_est):
+        for x_j in x:
+            k_ary[i] += np.log1p(-b_ary[i] * x_j)
+    k_ary /= len_x
+    len_scale = len_x * (np.log(-(b_ary / k_ary)) - k_ary - 1)
+    weights = np.empty(m_est)
+    for i in range(m_est):
+        weights[i] = 1 / np.sum(np.exp(len_scale - len_scale[i]))
+
+    # remove negligible weights
+    real_idxs = weights >= 10 * _EPS
+    weights = weights[real_idxs]
+    b_ary = b_ary[real_idxs]
+    # normalise weights
+    weights /= weights.sum()
+
+    # posterior mean for b
+    b_post = np.sum(b_ary * weights)
+    # estimate for k
+    k_post = np.mean(np.log1p(-b_post * x))
+    # add prior for k_post
+    k_post = (len_x * k_post + prior_k * 0.5) / (len_x + prior_k)
+    sigma = -k_post / b_post
+
+    return k_post, sigma
+
+
+@conditional_jit(nopython=True, cache=True, error_model="numpy")
+def _gpinv(probs, kappa, sigma):
+    """Inverse Generalized Pareto distribution function for probabilities in (0, 1)."""
+    if sigma <= 0:
+        return np.full_like(probs, np.nan)
+    if np.abs(kappa) < _EPS:
+        return -np.log1p(-probs) * sigma
+    return np.expm1(-kappa * np.log1p(-probs)) / kappa * sigma
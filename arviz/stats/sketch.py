@@ -0,0 +1,218 @@
+"""Mergeable quantile sketches for approximate HPD and quantiles of very long chains."""
+import copy
+
+import numpy as np
+
+__all__ = ["QuantileSketch"]
+
+
+class QuantileSketch:
+    """Approximate quantiles and HPD intervals from draws seen chunk by chunk.
+
+    The sketch keeps O(log(n_draws) / error) values per parameter instead of all the draws,
+    so very long chains (e.g. from SMC or VI runs) can be summarized without sorting or even
+    holding all the draws in memory. Sketches built from different chunks, chains or machines
+    can be combined with `merge`.
+
+    Parameters
+    ----------
+    error : float, optional
+        Target rank error of the estimates, as a fraction of the number of draws. A 0.005 error
+        means that the estimate of the 0.3 quantile lies between the exact 0.295 and 0.305
+        quantiles most of the time. Memory and time grow as 1 / error. Defaults to 0.005.
+    seed : int, optional
+        Seed of the random compactions, for reproducible estimates.
+
+    Notes
+    -----
+    This is a KLL style sketch [1]_ in which all the levels have the same capacity. Level `h`
+    stores values representing 2**h draws each. Whenever a level gets `1 / error` values, they
+    are sorted and every other value, starting at a random offset, is promoted to the next
+    level. All the parameters receive their draws at the same time, so their compactions
+    happen together and every level is stored as a single (values, params) array.
+
+    References
+    ----------
+    .. [1] Karnin, Lang and Liberty (2016). Optimal Quantile Approximation in Streams.
+        https://arxiv.org/abs/1603.05346
+
+    Examples
+    --------
+    .. code:: ipython
+
+        >>> sketch = az.QuantileSketch(error=0.001)
+        >>> for chunk in sampler:  # arrays of shape (draw, *shape)
+        ...     sketch.update(chunk)
+        >>> sketch.quantile([0.05, 0.5, 0.95]), sketch.hpd(credible_interval=0.9)
+    """
+
+    def __init__(self, error=0.005, seed=None):
+        if not 0 < error < 1:
+            raise ValueError("The error of the sketch must be between 0 and 1.")
+        self.error = error
+        self.n_draws = 0
+        self._capacity = max(int(np.ceil(1 / error)), 2)
+        self._rng = np.random.RandomState(seed)
+        self._shape = None
+        self._levels = []
+
+    def update(self, draws):
+        """Add a chunk of draws.
+
+        Parameters
+        ----------
+        draws : array-like
+            Draws with shape (draw, *shape). The shape of the parameters must be the same in
+            every chunk.
+
+        Returns
+        -------
+        QuantileSketch
+            The sketch itself, to chain calls.
+        """
+        draws = np.asarray(draws)
+        if draws.ndim == 0:
+            draws = draws[None]
+        if draws.dtype.kind != "f":
+            draws = draws.astype(np.float64)
+        if self._shape is None:
+            self._shape = draws.shape[1:]
+        elif draws.shape[1:] != self._shape:
+            raise ValueError("The shape of the parameters does not match the previous draws.")
+        if not len(draws):
+            return self
+
+        self._push(0, draws.reshape(len(draws), -1))
+        self.n_draws += len(draws)
+        self._compact()
+        return self
+
+    def merge(self, *others):
+        """Combine this sketch with sketches of other draws of the same parameters.
+
+        Parameters
+        ----------
+        others : QuantileSketch
+            Sketches with the same `error` and parameter shape.
+
+        Returns
+        -------
+        QuantileSketch
+            New sketch summarizing all the draws.
+        """
+        # pylint: disable=protected-access
+        merged = copy.deepcopy(self)
+        for other in others:
+            if other.error != self.error:
+                raise ValueError("Only sketches with the same error can be merged.")
+            if other.n_draws == 0:
+                continue
+            if merged._shape is None:
+                merged._shape = other._shape
+            elif other._shape != merged._shape:
+                raise ValueError("Only sketches of parameters with the same shape can be merged.")
+            for level, values in enumerate(other._levels):
+                merged._push(level, values)
+            merged.n_draws += other.n_draws
+            merged._compact()
+        return merged
+
+    def quantile(self, q):
+        """Estimate the quantiles of the draws seen so far.
+
+        Parameters
+        ----------
+        q : float or array-like of float
+            Quantiles to estimate, between 0 and 1.
+
+        Returns
+        -------
+        np.ndarray
+            Estimates with shape (*q.shape, *shape), like `np.quantile` along the draw axis.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if np.any((q < 0) | (q > 1)):
+            raise ValueError("Quantiles must be between 0 and 1.")
+        values, ranks = self._sorted_ranks()
+        estimates = _interp_sorted(values, ranks, q.ravel())
+        return estimates.reshape(q.shape + self._shape)
+
+    def hpd(self, credible_interval=0.94):
+        """Estimate the highest posterior density interval of the draws seen so far.
+
+        Parameters
+        ----------
+        credible_interval : float, optional
+            Credible interval. Defaults to 0.94.
+
+        Returns
+        -------
+        np.ndarray
+            Lower and upper value of the interval, along the last axis, like `az.hpd`.
+        """
+        if not 1 >= credible_interval > 0:
+            raise ValueError("Invalid credible interval")
+        values, ranks = self._sorted_ranks()
+        # candidate intervals every half of the rank error
+        n_intervals = max(int(np.ceil(2 * (1 - credible_interval) / self.error)), 1) + 1
+        lower_q = np.linspace(0, 1 - credible_interval, n_intervals)
+        lower = _interp_sorted(values, ranks, lower_q)
+        upper = _interp_sorted(values, ranks, lower_q + credible_interval)
+        min_idx = np.argmin(upper - lower, axis=0)[None]
+        interval = np.stack(
+            (
+                np.take_along_axis(lower, min_idx, axis=0)[0],
+                np.take_along_axis(upper, min_idx, axis=0)[0],
+            ),
+            axis=-1,
+        )
+        return interval.reshape(self._shape + (2,))
+
+    def _push(self, level, values):
+        if level == len(self._levels):
+            self._levels.append(values)
+        else:
+            self._levels[level] = np.concatenate((self._levels[level], values))
+
+    def _compact(self):
+        level = 0
+        while level < len(self._levels):
+            values = self._levels[level]
+            if len(values) >= self._capacity:
+                values = np.sort(values, axis=0)
+                n_left = len(values) % 2
+                offset = self._rng.randint(2)
+                self._levels[level] = values[:n_left]
+                self._push(level + 1, values[n_left + offset :: 2])
+            level += 1
+
+    def _sorted_ranks(self):
+        """Sort the stored values per parameter with their normalized midpoint ranks."""
+        if not self.n_draws:
+            raise ValueError("The sketch has not seen any draws.")
+        values = np.concatenate(self._levels)
+        weights = np.concatenate(
+            [np.full(len(ary), 2.0 ** level) for level, ary in enumerate(self._levels)]
+        )
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        weights = weights[order]
+        ranks = (np.cumsum(weights, axis=0) - weights / 2) / weights.sum(axis=0)
+        return values, ranks
+
+
+def _interp_sorted(values, ranks, q):
+    """Interpolate the (values, params) sorted values at quantiles `q`, per parameter."""
+    if len(values) == 1:
+        return np.repeat(values, len(q), axis=0)
+    # offsetting the (0, 1] ranks of every parameter by its column index sorts them all at once
+    n_values, n_params = ranks.shape
+    offsets = np.arange(n_params)
+    idx = np.searchsorted((ranks + offsets).ravel(order="F"), q[:, None] + offsets)
+    idx = np.clip(idx - offsets * n_values, 1, n_values - 1)
+    low_rank = np.take_along_axis(ranks, idx - 1, axis=0)
+    high_rank = np.take_along_axis(ranks, idx, axis=0)
+    low_value = np.take_along_axis(values, idx - 1, axis=0)
+    high_value = np.take_along_axis(values, idx, axis=0)
+    frac = np.clip((q[:, None] - low_rank) / (high_rank - low_rank), 0, 1)
+    return low_value + frac * (high_value - low_value)
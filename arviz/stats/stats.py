@@ -1,8 +1,11 @@
 # pylint: disable=too-many-lines
 """Statistical functions in ArviZ."""
+import hashlib
+import multiprocessing
 import warnings
-from collections import OrderedDict
 from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
@@ -10,11 +13,38 @@ import scipy.stats as st
 from scipy.optimize import minimize
 import xarray as xr
 
-from ..data import convert_to_inference_data, convert_to_dataset
-from .diagnostics import effective_sample_size, rhat
+from ..data import InferenceData, convert_to_inference_data, convert_to_dataset
+from . import kernels
+from .cache import cached
+from .diagnostics import (
+    ConvergenceMonitor,
+    _ess_batched,
+    _split_rhat,
+    effective_sample_size,
+    rhat,
+)
+from .sketch import QuantileSketch
+from .stats_utils import get_n_jobs, is_dask_dataset, wrap_xarray_ufunc
 from ..utils import _var_names
 
-__all__ = ["bfmi", "compare", "hpd", "loo", "psislw", "r2_score", "summary", "waic"]
+__all__ = [
+    "bfmi",
+    "compare",
+    "hpd",
+    "loo",
+    "loo_subsample",
+    "psislw",
+    "r2_score",
+    "summary",
+    "waic",
+    "diagnose_many",
+    "IncrementalSummary",
+]
+
+# number of log weights smoothed at once by the NumPy version of psislw
+_PSIS_BLOCK_ELEMENTS = 2 ** 22
+# number of draws fed at once to the sketch of summary(method="approx")
+_APPROX_CHUNK_SIZE = 100000
 
 
 def bfmi(energy):
@@ -165,28 +195,25 @@ def compare(
     ics.sort_values(by=ic, inplace=True, ascending=ascending)
 
     if method.lower() == "stacking":
-        rows, cols, ic_i_val = _ic_matrix(ics, ic_i)
-        exp_ic_i = np.exp(ic_i_val / scale_value)
+        _, cols, ic_i_val = _ic_matrix(ics, ic_i)
+        # the predictive densities are scaled by their maximum in every row, which does not
+        # move the optimum, so the exponentials never overflow or all underflow
+        log_ic_i = ic_i_val / scale_value
+        log_ic_i_max = np.max(log_ic_i, axis=1)
+        exp_ic_i = np.exp(log_ic_i - log_ic_i_max[:, None])
+        score_offset = np.sum(log_ic_i_max)
         last_col = cols - 1
 
         def w_fuller(weights):
             return np.concatenate((weights, [max(1.0 - np.sum(weights), 0.0)]))
 
         def log_score(weights):
-            w_full = w_fuller(weights)
-            score = 0.0
-            for i in range(rows):
-                score += np.log(np.dot(exp_ic_i[i], w_full))
-            return -score
+            return -(score_offset + np.sum(np.log(np.dot(exp_ic_i, w_fuller(weights)))))
 
         def gradient(weights):
-            w_full = w_fuller(weights)
-            grad = np.zeros(last_col)
-            for k in range(last_col - 1):
-                for i in range(rows):
-                    grad[k] += (exp_ic_i[i, k] - exp_ic_i[i, last_col]) / np.dot(
-                        exp_ic_i[i], w_full
-                    )
+            inv_density = 1 / np.dot(exp_ic_i, w_fuller(weights))
+            grad = np.dot(inv_density, exp_ic_i[:, :last_col])
+            grad -= np.dot(inv_density, exp_ic_i[:, last_col])
             return -grad
 
         theta = np.full(last_col, 1.0 / cols)
@@ -268,7 +295,7 @@ def _ic_matrix(ics, ic_i):
     return rows, cols, ic_i_val
 
 
-def hpd(x, credible_interval=0.94, circular=False):
+def hpd(x, credible_interval=0.94, circular=False, axis=0):
     """
     Calculate highest posterior density (HPD) of array for given credible_interval.
 
@@ -284,48 +311,59 @@ def hpd(x, credible_interval=0.94, circular=False):
     circular : bool, optional
         Whether to compute the hpd taking into account `x` is a circular variable
         (in the range [-np.pi, np.pi]) or not. Defaults to False (i.e non-circular variables).
+    axis : int, optional
+        Axis of `x` along which the samples are, the HPD of every other position is computed
+        at once. Defaults to 0, the columns of a 2D array being different parameters.
 
     Returns
     -------
     np.ndarray
-        lower and upper value of the interval.
+        lower and upper value of the interval, along the last axis. Its other dimensions are the
+        dimensions of `x` without `axis`.
     """
-    if x.ndim > 1:
-        hpd_array = np.array(
-            [hpd(row, credible_interval=credible_interval, circular=circular) for row in x.T]
-        )
-        return hpd_array
-    # Make a copy of trace
-    x = x.copy()
-    len_x = len(x)
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    interval_idx_inc = _hpd_interval_idx_inc(x.shape[-1], credible_interval)
 
     if circular:
-        mean = st.circmean(x, high=np.pi, low=-np.pi)
-        x = x - mean
+        mean = st.circmean(x, high=np.pi, low=-np.pi, axis=-1)
+        x = x - mean[..., None]
         x = np.arctan2(np.sin(x), np.cos(x))
 
-    x = np.sort(x)
-    interval_idx_inc = int(np.floor(credible_interval * len_x))
+    # a single sort of all the positions, np.sort returns a copy so x is never modified
+    interval = _hpd_sorted(np.sort(x, axis=-1), interval_idx_inc)
+
+    if circular:
+        interval = interval + mean[..., None]
+        interval = np.arctan2(np.sin(interval), np.cos(interval))
+
+    return interval
+
+
+def _hpd_sorted(x, interval_idx_inc):
+    """Narrowest interval spanning `interval_idx_inc` draws along the sorted last axis of `x`."""
+    len_x = x.shape[-1]
+    if kernels.NUMBA_AVAILABLE:
+        return kernels.hpd_search(x.reshape(-1, len_x), interval_idx_inc).reshape(
+            x.shape[:-1] + (2,)
+        )
+
     n_intervals = len_x - interval_idx_inc
-    interval_width = x[interval_idx_inc:] - x[:n_intervals]
+    interval_width = x[..., interval_idx_inc:] - x[..., :n_intervals]
+    min_idx = np.argmin(interval_width, axis=-1)[..., None]
+    hdi_min = np.take_along_axis(x, min_idx, axis=-1)[..., 0]
+    hdi_max = np.take_along_axis(x, min_idx + interval_idx_inc, axis=-1)[..., 0]
+    return np.stack((hdi_min, hdi_max), axis=-1)
+
 
-    if len(interval_width) == 0:
+def _hpd_interval_idx_inc(len_x, credible_interval):
+    """Count the draws spanned by the HPD interval, checking at least one interval fits."""
+    interval_idx_inc = int(np.floor(credible_interval * len_x))
+    if len_x - interval_idx_inc <= 0:
         raise ValueError(
             "Too few elements for interval calculation. "
             "Check that credible_interval meets condition 0 =< credible_interval < 1"
         )
-
-    min_idx = np.argmin(interval_width)
-    hdi_min = x[min_idx]
-    hdi_max = x[min_idx + interval_idx_inc]
-
-    if circular:
-        hdi_min = hdi_min + mean
-        hdi_max = hdi_max + mean
-        hdi_min = np.arctan2(np.sin(hdi_min), np.cos(hdi_min))
-        hdi_max = np.arctan2(np.sin(hdi_max), np.cos(hdi_max))
-
-    return np.array([hdi_min, hdi_max])
+    return interval_idx_inc
 
 
 def _logsumexp(ary, *, b=None, b_inv=None, axis=None, keepdims=False, out=None, copy=True):
@@ -338,6 +376,8 @@ def _logsumexp(ary, *, b=None, b_inv=None, axis=None, keepdims=False, out=None,
     if ary.dtype.kind == "i":
         ary = ary.astype(np.float64)
     dtype = ary.dtype.type
+    # the sum of exponentials is accumulated in at least double precision
+    out_dtype = np.promote_types(dtype, np.float64).type
     shape = ary.shape
     shape_len = len(shape)
     if isinstance(axis, Sequence):
@@ -361,9 +401,9 @@ def _logsumexp(ary, *, b=None, b_inv=None, axis=None, keepdims=False, out=None,
             )
         else:
             out_shape = shape_max
-        out = np.empty(out_shape, dtype=dtype)
+        out = np.empty(out_shape, dtype=out_dtype)
     if b_inv == 0:
-        return np.full_like(out, np.inf, dtype=dtype) if out.shape else np.inf
+        return np.full_like(out, np.inf) if out.shape else np.inf
     if b_inv is None and b == 0:
         return np.full_like(out, -np.inf) if out.shape else -np.inf
     ary_max = np.empty(shape_max, dtype=dtype)
@@ -381,10 +421,10 @@ def _logsumexp(ary, *, b=None, b_inv=None, axis=None, keepdims=False, out=None,
         ary_max += np.log(b)
     out += ary_max.squeeze() if not keepdims else ary_max
     # transform to scalar if possible
-    return out if out.shape else dtype(out)
+    return out if out.shape else out_dtype(out)
 
 
-def loo(data, pointwise=False, reff=None, scale="deviance"):
+def loo(data, pointwise=False, reff=None, scale="deviance", chunk_size=None, store_psis=False):
     """Pareto-smoothed importance sampling leave-one-out cross-validation.
 
     Calculates leave-one-out (LOO) cross-validation for out of sample predictive model fit,
@@ -396,15 +436,28 @@ def loo(data, pointwise=False, reff=None, scale="deviance"):
     data : result of MCMC run
     pointwise: bool, optional
         if True the pointwise predictive accuracy will be returned. Defaults to False
-    reff : float, optional
+    reff : float or "mean", optional
         Relative MCMC efficiency, `effective_n / n` i.e. number of effective samples divided by
-        the number of actual samples. Computed from trace by default.
+        the number of actual samples. By default, one value per observation is computed from
+        the effective sample size of its likelihood draws. "mean" uses the average of these
+        values for all the observations. The posterior variables are never used.
     scale : str
         Output scale for loo. Available options are:
 
         - `deviance` : (default) -2 * (log-score)
         - `log` : 1 * log-score (after Vehtari et al. (2017))
         - `negative_log` : -1 * (log-score)
+    chunk_size : int, optional
+        Number of observations, along the first observation dimension of the log likelihood,
+        processed at once. Only one chunk of the log likelihood is in memory at a time, so
+        lazily opened, memory mapped or dask backed data is never fully loaded. Defaults to
+        None, all the observations at once.
+    store_psis : bool, optional
+        Store the pointwise PSIS results (`loo_i` on the log scale, `lppd_i` and `pareto_k`)
+        in a `psis` group of `data`, which must be an InferenceData. The group is saved by
+        `to_netcdf` with the other groups. Whenever `data` has a `psis` group computed from
+        the same log likelihood and `reff`, the stored results are reused instead of
+        smoothing the importance weights again, also by `compare`. Defaults to False.
 
     Returns
     -------
@@ -426,11 +479,7 @@ def loo(data, pointwise=False, reff=None, scale="deviance"):
             )
     if "log_likelihood" not in inference_data.sample_stats:
         raise TypeError("Data must include log_likelihood in sample_stats")
-    posterior = inference_data.posterior
     log_likelihood = inference_data.sample_stats.log_likelihood
-    n_samples = log_likelihood.chain.size * log_likelihood.draw.size
-    new_shape = (n_samples,) + log_likelihood.shape[2:]
-    log_likelihood = log_likelihood.values.reshape(*new_shape)
 
     if scale.lower() == "deviance":
         scale_value = -2
@@ -441,17 +490,35 @@ def loo(data, pointwise=False, reff=None, scale="deviance"):
     else:
         raise TypeError('Valid scale values are "deviance", "log", "negative_log"')
 
-    if reff is None:
-        n_chains = len(posterior.chain)
-        if n_chains == 1:
-            reff = 1.0
-        else:
-            ess = effective_sample_size(posterior)
-            # this mean is over all data variables
-            reff = np.hstack([ess[v].values.flatten() for v in ess.data_vars]).mean() / n_samples
-
-    log_weights, pareto_shape = psislw(-log_likelihood, reff)
-    log_weights += log_likelihood
+    if isinstance(reff, str) and reff != "mean":
+        raise ValueError('Valid reff values are None, "mean" or a number')
+    if store_psis and not isinstance(data, InferenceData):
+        raise TypeError("PSIS results can only be stored in an InferenceData.")
+
+    psis = getattr(inference_data, "psis", None)
+    psis_key = None
+    if store_psis or psis is not None:
+        psis_key = _psis_key(log_likelihood, reff, chunk_size)
+    if psis is not None and psis.attrs.get("log_likelihood_key") == psis_key:
+        loo_i, lppd_i, pareto_shape = (
+            psis[var_name].values for var_name in ("loo_i", "lppd_i", "pareto_k")
+        )
+    else:
+        loo_i, lppd_i, pareto_shape = _loo_pointwise(log_likelihood, reff, chunk_size)
+        if store_psis:
+            template = log_likelihood.isel(chain=0, draw=0, drop=True)
+            data.psis = xr.Dataset(
+                {
+                    "loo_i": (template.dims, loo_i),
+                    "lppd_i": (template.dims, lppd_i),
+                    "pareto_k": (template.dims, pareto_shape),
+                },
+                coords=template.coords,
+                attrs={"log_likelihood_key": psis_key},
+            )
+            if "psis" not in data._groups:  # pylint: disable=protected-access
+                data._groups.append("psis")  # pylint: disable=protected-access
+    loo_lppd_i = scale_value * loo_i
 
     warn_mg = 0
     if np.any(pareto_shape > 0.7):
@@ -464,11 +531,10 @@ def loo(data, pointwise=False, reff=None, scale="deviance"):
         )
         warn_mg = 1
 
-    loo_lppd_i = scale_value * _logsumexp(log_weights, axis=0)
     loo_lppd = loo_lppd_i.sum()
     loo_lppd_se = (len(loo_lppd_i) * np.var(loo_lppd_i)) ** 0.5
 
-    lppd = np.sum(_logsumexp(log_likelihood, axis=0, b_inv=log_likelihood.shape[0]))
+    lppd = np.sum(lppd_i)
     p_loo = lppd - loo_lppd / scale_value
 
     if pointwise:
@@ -490,6 +556,70 @@ def loo(data, pointwise=False, reff=None, scale="deviance"):
         )
 
 
+@cached
+def _loo_pointwise(log_likelihood, reff, chunk_size):
+    """Pointwise PSIS-LOO results, on the log scale, of a (chain, draw, *obs) log likelihood.
+
+    Returns
+    -------
+    loo_i : Numpy array
+        Leave-one-out log predictive density of every observation.
+    lppd_i : Numpy array
+        Log pointwise predictive density of every observation.
+    pareto_k : Numpy array
+        Estimated shape parameter of the Pareto tail of every observation.
+    """
+    n_chains = log_likelihood.chain.size
+    n_samples = n_chains * log_likelihood.draw.size
+    if isinstance(reff, str):
+        if n_chains == 1:
+            reff = 1.0
+        else:
+            reff = np.mean(
+                np.concatenate(
+                    [
+                        _loo_reff(log_likelihood_chunk, n_chains)
+                        for log_likelihood_chunk in _log_likelihood_chunks(
+                            log_likelihood, chunk_size
+                        )
+                    ]
+                )
+            )
+
+    loo_i, pareto_shape, lppd_i = [], [], []
+    for log_likelihood_chunk in _log_likelihood_chunks(log_likelihood, chunk_size):
+        if reff is None:
+            reff_chunk = 1.0 if n_chains == 1 else _loo_reff(log_likelihood_chunk, n_chains)
+        else:
+            reff_chunk = reff
+        log_weights, pareto_shape_chunk = psislw(-log_likelihood_chunk, reff_chunk)
+        log_weights += log_likelihood_chunk
+        loo_i.append(_logsumexp(log_weights, axis=0))
+        lppd_i.append(_logsumexp(log_likelihood_chunk, axis=0, b_inv=n_samples))
+        pareto_shape.append(pareto_shape_chunk)
+        del log_weights
+    obs_shape = log_likelihood.shape[2:]
+    return tuple(
+        np.concatenate(pointwise).reshape(obs_shape) for pointwise in (loo_i, lppd_i, pareto_shape)
+    )
+
+
+def _psis_key(log_likelihood, reff, chunk_size=None):
+    """Hash the log likelihood and `reff` the PSIS results stored in InferenceData come from.
+
+    The log likelihood is hashed one chunk at a time and observation by observation, so the
+    key does not depend on `chunk_size`. Coordinates are not hashed, their types can change
+    when saving to netCDF.
+    """
+    if reff is not None and not isinstance(reff, str):
+        reff = float(reff)
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update("{}{}{!r}".format(log_likelihood.dtype.str, log_likelihood.shape, reff).encode())
+    for log_likelihood_chunk in _log_likelihood_chunks(log_likelihood, chunk_size):
+        hasher.update(np.ascontiguousarray(log_likelihood_chunk.T).reshape(-1).view(np.uint8))
+    return hasher.hexdigest()
+
+
 def psislw(log_weights, reff=1.0):
     """
     Pareto smoothed importance sampling (PSIS).
@@ -498,8 +628,9 @@ def psislw(log_weights, reff=1.0):
     ----------
     log_weights : array
         Array of size (n_samples, n_observations)
-    reff : float
-        relative MCMC efficiency, `ess / n`
+    reff : float or array
+        relative MCMC efficiency, `ess / n`, either common to all the observations or one
+        value per observation
 
     Returns
     -------
@@ -511,54 +642,112 @@ def psislw(log_weights, reff=1.0):
     rows, cols = log_weights.shape
 
     log_weights_out = np.copy(log_weights, order="F")
-    kss = np.empty(cols)
 
     # precalculate constants
-    cutoff_ind = -int(np.ceil(min(rows / 5.0, 3 * (rows / reff) ** 0.5))) - 1
+    cutoff_inds = -np.ceil(np.minimum(rows / 5.0, 3 * (rows / np.asarray(reff)) ** 0.5)) - 1
+    if not cutoff_inds.ndim:
+        return log_weights_out, _psis_smooth(log_weights_out, int(cutoff_inds))
+
+    # observations with different efficiencies are smoothed in groups sharing their cutoff
+    cutoff_inds = np.broadcast_to(cutoff_inds, (cols,)).astype(int)
+    kss = np.empty(cols)
+    for cutoff_ind in np.unique(cutoff_inds):
+        group = np.flatnonzero(cutoff_inds == cutoff_ind)
+        group_weights = np.asfortranarray(log_weights_out[:, group])
+        kss[group] = _psis_smooth(group_weights, cutoff_ind)
+        log_weights_out[:, group] = group_weights
+    return log_weights_out, kss
+
+
+def _psis_smooth(log_weights, cutoff_ind):
+    """Pareto smooth every column of a Fortran ordered array of log weights in place.
+
+    Returns
+    -------
+    kss : Numpy array
+        Pareto tail indices of shape (observations,)
+    """
+    rows, cols = log_weights.shape
     cutoffmin = np.log(np.finfo(float).tiny)  # pylint: disable=no-member, assignment-from-no-return
     k_min = 1.0 / 3
 
-    # loop over sets of log weights
-    for i, x in enumerate(log_weights_out.T):
-        # improve numerical accuracy
-        x -= np.max(x)
-        # sort the array
-        x_sort_ind = np.argsort(x)
-        # divide log weights into body and right tail
-        xcutoff = max(x[x_sort_ind[cutoff_ind]], cutoffmin)
-
-        expxcutoff = np.exp(xcutoff)
-        tailinds, = np.where(x > xcutoff)  # pylint: disable=unbalanced-tuple-unpacking
-        x_tail = x[tailinds]
-        tail_len = len(x_tail)
-        if tail_len <= 4:
-            # not enough tail samples for gpdfit
-            k = np.inf
-        else:
-            # order of tail samples
-            x_tail_si = np.argsort(x_tail)
+    if kernels.NUMBA_AVAILABLE:
+        return kernels.psis_smooth(log_weights.T, cutoff_ind, cutoffmin, k_min)
+
+    kss = np.empty(cols)
+    # process blocks of observations small enough to keep the temporaries in memory
+    block_size = max(_PSIS_BLOCK_ELEMENTS // rows, 1)
+    for start in range(0, cols, block_size):
+        block = log_weights[:, start : start + block_size]
+        kss[start : start + block_size] = _psis_smooth_block(block, cutoff_ind, cutoffmin, k_min)
+    return kss
+
+
+def _psis_smooth_block(x, cutoff_ind, cutoffmin, k_min):
+    """Pareto smooth every column of a (samples, observations) block of log weights in place.
+
+    Returns
+    -------
+    kss : Numpy array
+        Pareto tail indices of shape (observations,)
+    """
+    rows, cols = x.shape
+    col_idx = np.arange(cols)
+    # improve numerical accuracy
+    x -= np.max(x, axis=0)
+    # only the draws above the cutoff have to be sorted
+    cutoff_pos = rows + cutoff_ind
+    top_idx = np.argpartition(x, cutoff_pos, axis=0)[cutoff_pos:]
+    top = np.take_along_axis(x, top_idx, axis=0)
+    top_order = np.argsort(top, axis=0, kind="stable")
+    top_idx = np.take_along_axis(top_idx, top_order, axis=0)
+    top = np.take_along_axis(top, top_order, axis=0)
+    # divide log weights into body and right tail
+    xcutoff = np.maximum(top[0], cutoffmin)
+    expxcutoff = np.exp(xcutoff)
+    tail_lens = np.sum(top > xcutoff, axis=0)
+
+    # not enough tail samples for gpdfit
+    kss = np.full(cols, np.inf)
+    # the tail of every column is the end of its sorted top, columns with the same tail
+    # length are fitted together
+    for tail_len in np.unique(tail_lens[tail_lens > 4]):
+        fit_cols = col_idx[tail_lens == tail_len]
+        sti = np.arange(0.5, tail_len) / tail_len
+        m_est = 30 + int(tail_len ** 0.5)
+        fit_block = max(_PSIS_BLOCK_ELEMENTS // (m_est * max(tail_len, m_est)), 1)
+        for fit_start in range(0, len(fit_cols), fit_block):
+            tail_cols = fit_cols[fit_start : fit_start + fit_block]
+            tail_idx = top_idx[-tail_len:, tail_cols]
+            x_tail = top[-tail_len:, tail_cols]
             # fit generalized Pareto distribution to the right tail samples
-            x_tail = np.exp(x_tail) - expxcutoff
-            k, sigma = _gpdfit(x_tail[x_tail_si])
-
-            if k >= k_min:
-                # no smoothing if short tail or GPD fit failed
-                # compute ordered statistic for the fit
-                sti = np.arange(0.5, tail_len) / tail_len
-                smoothed_tail = _gpinv(sti, k, sigma)
-                smoothed_tail = np.log(  # pylint: disable=assignment-from-no-return
-                    smoothed_tail + expxcutoff
+            k, sigma = _gpdfit(np.exp(x_tail) - expxcutoff[tail_cols])
+            kss[tail_cols] = k
+
+            # no smoothing if short tail or GPD fit failed
+            smooth = k >= k_min
+            if not smooth.any():
+                continue
+            tail_cols, tail_idx = tail_cols[smooth], tail_idx[:, smooth]
+            k, sigma = k[smooth], sigma[smooth]
+            # compute ordered statistic for the fit
+            with np.errstate(divide="ignore", invalid="ignore"):
+                smoothed_tail = np.where(
+                    np.abs(k) < np.finfo(float).eps,
+                    -np.log1p(-sti)[:, None],
+                    np.expm1(-k * np.log1p(-sti)[:, None]) / k,
                 )
-                # place the smoothed tail into the output array
-                x[tailinds[x_tail_si]] = smoothed_tail
-                # truncate smoothed values to the largest raw weight 0
-                x[x > 0] = 0
-        # renormalize weights
-        x -= _logsumexp(x)
-        # store tail index k
-        kss[i] = k
+            smoothed_tail *= sigma
+            smoothed_tail[:, ~(sigma > 0)] = np.nan
+            # place the smoothed tail into the output array
+            x[tail_idx, tail_cols] = np.log(smoothed_tail + expxcutoff[tail_cols])
+            # truncate smoothed values to the largest raw weight 0
+            smoothed = x[:, tail_cols]
+            x[:, tail_cols] = np.where(smoothed > 0, 0, smoothed)
 
-    return log_weights_out, kss
+    # renormalize weights
+    x -= _logsumexp(x, axis=0)
+    return kss
 
 
 def _gpdfit(x):
@@ -570,44 +759,46 @@ def _gpdfit(x):
     Parameters
     ----------
     x : array
-        sorted 1D data array
+        sorted 1D data array, or 2D array whose columns are sorted to fit several
+        distributions at once
 
     Returns
     -------
-    k : float
-        estimated shape parameter
-    sigma : float
-        estimated scale parameter
+    k : float or array
+        estimated shape parameter, one per column for 2D input
+    sigma : float or array
+        estimated scale parameter, one per column for 2D input
     """
     prior_bs = 3
     prior_k = 10
+    ndim = np.ndim(x)
+    x = np.reshape(x, (len(x), -1))
     len_x = len(x)
     m_est = 30 + int(len_x ** 0.5)
 
     b_ary = 1 - np.sqrt(m_est / (np.arange(1, m_est + 1, dtype=float) - 0.5))
-    b_ary /= prior_bs * x[int(len_x / 4 + 0.5) - 1]
+    b_ary = b_ary[:, None] / (prior_bs * x[int(len_x / 4 + 0.5) - 1])
     b_ary += 1 / x[-1]
 
-    k_ary = np.log1p(-b_ary[:, None] * x).mean(axis=1)  # pylint: disable=no-member
+    k_ary = np.log1p(-b_ary[:, None, :] * x[None, :, :]).mean(axis=1)  # pylint: disable=no-member
     len_scale = len_x * (np.log(-(b_ary / k_ary)) - k_ary - 1)
-    weights = 1 / np.exp(len_scale - len_scale[:, None]).sum(axis=1)
+    weights = 1 / np.exp(len_scale[None, :, :] - len_scale[:, None, :]).sum(axis=1)
 
     # remove negligible weights
-    real_idxs = weights >= 10 * np.finfo(float).eps
-    if not np.all(real_idxs):
-        weights = weights[real_idxs]
-        b_ary = b_ary[real_idxs]
+    weights = np.where(weights >= 10 * np.finfo(float).eps, weights, 0)
     # normalise weights
-    weights /= weights.sum()
+    weights /= weights.sum(axis=0)
 
     # posterior mean for b
-    b_post = np.sum(b_ary * weights)
+    b_post = np.sum(b_ary * weights, axis=0)
     # estimate for k
-    k_post = np.log1p(-b_post * x).mean()  # pylint: disable=invalid-unary-operand-type,no-member
+    k_post = np.log1p(-b_post * x).mean(axis=0)  # pylint: disable=invalid-unary-operand-type
     # add prior for k_post
     k_post = (len_x * k_post + prior_k * 0.5) / (len_x + prior_k)
     sigma = -k_post / b_post
 
+    if ndim == 1:
+        return k_post[0], sigma[0]
     return k_post, sigma
 
 
@@ -668,6 +859,7 @@ def r2_score(y_true, y_pred):
     return pd.Series([np.mean(r_squared), np.std(r_squared)], index=["r2", "r2_std"])
 
 
+@cached
 def summary(
     data,
     var_names=None,
@@ -678,6 +870,9 @@ def summary(
     extend=True,
     credible_interval=0.94,
     order="C",
+    n_jobs=1,
+    method="exact",
+    mcse_method="batch",
 ):
     """Create a data frame with summary statistics.
 
@@ -685,15 +880,18 @@ def summary(
     ----------
     data : obj
         Any object that can be converted to an az.InferenceData object
-        Refer to documentation of az.convert_to_dataset for details
+        Refer to documentation of az.convert_to_dataset for details. Dask backed posteriors
+        are processed chunk by chunk without loading them into memory, the result is lazy
+        if fmt is "xarray".
     var_names : list
         Names of variables to include in summary
     include_circ : bool
         Whether to include circular statistics
     fmt : {'wide', 'long', 'xarray'}
         Return format is either pandas.DataFrame {'wide', 'long'} or xarray.Dataset {'xarray'}.
-    round_to : int
-        Number of decimals used to round results. Defaults to 2.
+    round_to : int or None
+        Number of decimals used to round results. Defaults to 2, use None to return
+        results with full precision.
     stat_funcs : dict
         A list of functions or a dict of functions with function names as keys used to calculate
         statistics. By default, the mean, standard deviation, simulation standard error, and
@@ -710,6 +908,18 @@ def summary(
         None.
     order : {"C", "F"}
         If fmt is "wide", use either C or F unpacking order. Defaults to C.
+    n_jobs : int, optional
+        Number of threads used to split the variables and their parameters when computing
+        the statistics. -1 uses all the available cores. Defaults to 1.
+    method : {"exact", "approx"}
+        How the (non circular) HPD intervals are computed. "exact" sorts all the draws, "approx"
+        feeds them chunk by chunk to a `QuantileSketch`, which is faster and lighter on memory
+        for very long chains. Defaults to "exact".
+    mcse_method : {"batch", "overlapping", "ess"}
+        Estimate of the (non circular) "mc error" column. "batch" (default) uses the means of 5
+        consecutive batches of draws, "overlapping" the means of all the overlapping windows of
+        a fifth of the draws, and "ess" the standard deviation divided by the square root of the
+        effective sample size, which needs at least 2 chains.
 
     Returns
     -------
@@ -747,14 +957,14 @@ def summary(
     var_names = _var_names(var_names, posterior)
     posterior = posterior if var_names is None else posterior[var_names]
 
-    fmt_group = ("wide", "long", "xarray")
-    if not isinstance(fmt, str) or (fmt.lower() not in fmt_group):
-        raise TypeError("Invalid format: '{}'! Formatting options are: {}".format(fmt, fmt_group))
+    _check_summary_format(fmt, order)
 
-    unpack_order_group = ("C", "F")
-    if not isinstance(order, str) or (order.upper() not in unpack_order_group):
-        raise TypeError(
-            "Invalid order: '{}'! Unpacking options are: {}".format(order, unpack_order_group)
+    if method not in ("exact", "approx"):
+        raise ValueError("Invalid method: '{}'! Methods are: ('exact', 'approx')".format(method))
+    mcse_methods = ("batch", "overlapping", "ess")
+    if mcse_method not in mcse_methods:
+        raise ValueError(
+            "Invalid mcse_method: '{}'! Methods are: {}".format(mcse_method, mcse_methods)
         )
 
     alpha = 1 - credible_interval
@@ -765,125 +975,210 @@ def summary(
     if stat_funcs is not None:
         if isinstance(stat_funcs, dict):
             for stat_func_name, stat_func in stat_funcs.items():
-                metrics.append(
-                    xr.apply_ufunc(
-                        _make_ufunc(stat_func), posterior, input_core_dims=(("chain", "draw"),)
-                    )
-                )
+                metrics.append(wrap_xarray_ufunc(_make_ufunc(stat_func), posterior, n_jobs=n_jobs))
                 metric_names.append(stat_func_name)
         else:
             for stat_func in stat_funcs:
-                metrics.append(
-                    xr.apply_ufunc(
-                        _make_ufunc(stat_func), posterior, input_core_dims=(("chain", "draw"),)
-                    )
-                )
+                metrics.append(wrap_xarray_ufunc(_make_ufunc(stat_func), posterior, n_jobs=n_jobs))
                 metric_names.append(stat_func.__name__)
 
+    # the default statistics are computed by a single fused ufunc returning all of them
+    # along a trailing "metric" dimension
+    fused_names = []
     if extend:
-        metrics.append(posterior.mean(dim=("chain", "draw")))
-        metric_names.append("mean")
+        fused_names.extend(
+            [
+                "mean",
+                "sd",
+                "mc error",
+                "hpd {:g}%".format(100 * alpha / 2),
+                "hpd {:g}%".format(100 * (1 - alpha / 2)),
+            ]
+        )
+    if include_circ:
+        fused_names.extend(
+            [
+                "circular mean",
+                "circular standard deviation",
+                "circular mc error",
+                "circular hpd {:.2%}".format(alpha / 2),
+                "circular hpd {:.2%}".format(1 - alpha / 2),
+            ]
+        )
+    if len(posterior.chain) > 1:
+        fused_names.extend(["ess", "r_hat"])
+
+    if fused_names:
+        fused = wrap_xarray_ufunc(
+            _make_summary_ufunc(credible_interval, extend, include_circ, method, mcse_method),
+            posterior,
+            n_jobs=n_jobs,
+            output_sizes={"metric": len(fused_names)},
+        )
+        metrics.append(fused.transpose("metric", *posterior.isel(chain=0, draw=0).dims))
+        metric_names.extend(fused_names)
 
-        metrics.append(posterior.std(dim=("chain", "draw")))
-        metric_names.append("sd")
+    # concat puts the new "metric" dimension of the stat_funcs results last
+    joined = xr.concat(metrics, dim="metric").assign_coords(metric=metric_names)
+    joined = joined.transpose("metric", *posterior.isel(chain=0, draw=0).dims)
+    if fmt.lower() != "xarray" and is_dask_dataset(joined):
+        joined = joined.compute()
 
-        metrics.append(
-            xr.apply_ufunc(_make_ufunc(_mc_error), posterior, input_core_dims=(("chain", "draw"),))
-        )
-        metric_names.append("mc error")
+    return _format_summary(joined, fmt, order, round_to)
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(hpd, index=0, credible_interval=credible_interval),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("hpd {:g}%".format(100 * alpha / 2))
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(hpd, index=1, credible_interval=credible_interval),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("hpd {:g}%".format(100 * (1 - alpha / 2)))
+class IncrementalSummary(ConvergenceMonitor):
+    """Summary statistics of a growing trace, updated as new draws are appended.
 
-    if include_circ:
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(st.circmean, high=np.pi, low=-np.pi),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("circular mean")
+    The mean, standard deviation, Monte Carlo standard error, effective sample size and
+    split R-hat are computed from running per chain moments and lagged sums of products, see
+    `ConvergenceMonitor`, so appending draws costs O(new draws * max_lag) whatever the length
+    of the trace. The HPD interval is an order statistic and is only recomputed from the
+    stored draws when asked for.
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(st.circstd, high=np.pi, low=-np.pi),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("circular standard deviation")
+    Parameters
+    ----------
+    data : obj, optional
+        Current posterior, any object that can be converted to an az.InferenceData object, in
+        which case the posterior group is used. Numpy arrays have shape (chain, draw, *shape).
+    var_names : list, optional
+        Names of the variables to summarize.
+    max_lag : int, optional
+        Number of autocovariance lags tracked for the effective sample size, see
+        `ConvergenceMonitor`. Defaults to 100.
+    keep_draws : bool, optional
+        Store the draws to compute the exact HPD intervals. Defaults to True, use False to
+        keep the memory constant when the HPD is never needed.
+
+    Notes
+    -----
+    The "mc error" column is the standard error of the mean estimated as sd / sqrt(ess),
+    like `summary(..., mcse_method="ess")`, because the batches of the default batch means
+    estimate move as the chains grow. With a single chain, its effective sample size is
+    computed from the autocorrelation of that chain alone, and the "ess" and "r_hat"
+    columns are left out like in `summary`.
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(_mc_error, circular=True),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("circular mc error")
+    Examples
+    --------
+    .. code:: ipython
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(hpd, index=0, credible_interval=credible_interval, circular=True),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
-        )
-        metric_names.append("circular hpd {:.2%}".format(alpha / 2))
+        >>> incremental = az.IncrementalSummary(trace, var_names=["mu", "tau"])
+        >>> for block in sampler:
+        ...     incremental.update(block)
+        ...     print(incremental.summary())
+        >>> incremental.summary(include_hpd=True)
+    """
 
-        metrics.append(
-            xr.apply_ufunc(
-                _make_ufunc(hpd, index=1, credible_interval=credible_interval, circular=True),
-                posterior,
-                input_core_dims=(("chain", "draw"),),
-            )
+    def __init__(self, data=None, var_names=None, max_lag=100, keep_draws=True):
+        super().__init__(max_lag=max_lag)
+        self.var_names = var_names
+        self.keep_draws = keep_draws
+        self._draws = {}
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        """Append a block of draws to every chain.
+
+        Parameters
+        ----------
+        data : obj
+            Block of new draws, with the same variables, chains and shapes as the previous
+            ones. See `ConvergenceMonitor.update`.
+        """
+        posterior = convert_to_dataset(data, group="posterior")
+        var_names = _var_names(self.var_names, posterior)
+        posterior = posterior if var_names is None else posterior[var_names]
+        super().update(posterior)
+        if self.keep_draws:
+            for var_name in posterior.data_vars:
+                self._draws.setdefault(var_name, []).append(posterior[var_name].values)
+
+    def summary(self, fmt="wide", round_to=2, credible_interval=0.94, include_hpd=False, order="C"):
+        """Summarize the draws seen so far.
+
+        Parameters
+        ----------
+        fmt : {'wide', 'long', 'xarray'}
+            Return format, see `az.summary`.
+        round_to : int or None
+            Number of decimals used to round results. Defaults to 2, use None to return
+            results with full precision.
+        credible_interval : float, optional
+            Credible interval of the HPD columns. Defaults to 0.94.
+        include_hpd : bool, optional
+            Recompute the exact HPD interval from all the stored draws. Defaults to False.
+        order : {"C", "F"}
+            If fmt is "wide", use either C or F unpacking order. Defaults to C.
+
+        Returns
+        -------
+        pandas.DataFrame or xarray.Dataset
+        """
+        _check_summary_format(fmt, order)
+        if not self._states:
+            raise ValueError("No draws have been added to the summary yet.")
+        if include_hpd and not self.keep_draws:
+            raise ValueError("The HPD can only be computed if the draws are kept.")
+
+        alpha = 1 - credible_interval
+        multiple_chains = next(iter(self._states.values())).n_chain > 1
+        metric_names = ["mean", "sd", "mc error"]
+        if include_hpd:
+            metric_names.append("hpd {:g}%".format(100 * alpha / 2))
+            metric_names.append("hpd {:g}%".format(100 * (1 - alpha / 2)))
+        if multiple_chains:
+            metric_names.extend(["ess", "r_hat"])
+
+        results = {}
+        for var_name, state in self._states.items():
+            # the running moments are kept relative to a per parameter shift
+            count, chain_mean, chain_m2 = state.moments()
+            mean = chain_mean.mean(axis=0)
+            m2 = chain_m2.sum(axis=0) + count * np.sum((chain_mean - mean) ** 2, axis=0)
+            sd = np.sqrt(m2 / (state.n_chain * count))
+            ess = state.effective_sample_size(single_chain=True)
+            metrics = [mean + state.shift, sd, sd / np.sqrt(ess)]
+            if include_hpd:
+                interval = self._hpd(var_name, credible_interval)
+                metrics.extend([interval[..., 0], interval[..., 1]])
+            if multiple_chains:
+                metrics.extend([ess, state.rhat()])
+            results[var_name] = (("metric",) + self._template[var_name].dims, np.stack(metrics))
+
+        joined = xr.Dataset(results, coords=self._template.coords).assign_coords(
+            metric=metric_names
         )
-        metric_names.append("circular hpd {:.2%}".format(1 - alpha / 2))
+        return _format_summary(joined, fmt, order, round_to)
 
-    if len(posterior.chain) > 1:
-        metrics.append(effective_sample_size(posterior, var_names=var_names))
-        metric_names.append("ess")
+    def _hpd(self, var_name, credible_interval):
+        draws = self._draws[var_name]
+        if len(draws) > 1:
+            # keep the concatenation so later calls only append the new blocks
+            draws[:] = [np.concatenate(draws, axis=1)]
+        ary = draws[0]
+        return hpd(ary.reshape((-1,) + ary.shape[2:]), credible_interval=credible_interval)
 
-        metrics.append(rhat(posterior, var_names=var_names))
-        metric_names.append("r_hat")
 
-    joined = xr.concat(metrics, dim="metric").assign_coords(metric=metric_names)
+def _check_summary_format(fmt, order):
+    """Validate the fmt and order arguments of summary."""
+    fmt_group = ("wide", "long", "xarray")
+    if not isinstance(fmt, str) or (fmt.lower() not in fmt_group):
+        raise TypeError("Invalid format: '{}'! Formatting options are: {}".format(fmt, fmt_group))
 
+    unpack_order_group = ("C", "F")
+    if not isinstance(order, str) or (order.upper() not in unpack_order_group):
+        raise TypeError(
+            "Invalid order: '{}'! Unpacking options are: {}".format(order, unpack_order_group)
+        )
+
+
+def _format_summary(joined, fmt, order, round_to):
+    """Format a Dataset with a leading metric dimension as summary does."""
     if fmt.lower() == "wide":
-        dfs = []
-        for var_name, values in joined.data_vars.items():
-            if len(values.shape[1:]):
-                metric = list(values.metric.values)
-                data_dict = OrderedDict()
-                for idx in np.ndindex(values.shape[1:] if order == "C" else values.shape[1:][::-1]):
-                    if order == "F":
-                        idx = tuple(idx[::-1])
-                    ser = pd.Series(values[(Ellipsis, *idx)].values, index=metric)
-                    key = "{}[{}]".format(var_name, ",".join(map(str, idx)))
-                    data_dict[key] = ser
-                df = pd.DataFrame.from_dict(data_dict, orient="index")
-                df = df.loc[list(data_dict.keys())]
-            else:
-                df = values.to_dataframe()
-                df.index = list(df.index)
-                df = df.T
-            dfs.append(df)
+        dfs = [
+            _wide_summary(var_name, values, order) for var_name, values in joined.data_vars.items()
+        ]
         summary_df = pd.concat(dfs, sort=False)
     elif fmt.lower() == "long":
         df = joined.to_dataframe().reset_index().set_index("metric")
@@ -891,7 +1186,7 @@ def summary(
         summary_df = df
     else:
         summary_df = joined
-    return summary_df.round(round_to)
+    return summary_df if round_to is None else summary_df.round(round_to)
 
 
 def _make_ufunc(func, index=Ellipsis, **kwargs):  # noqa: D202
@@ -906,7 +1201,118 @@ def _make_ufunc(func, index=Ellipsis, **kwargs):  # noqa: D202
     return _ufunc
 
 
-def _mc_error(x, batches=5, circular=False):
+def _make_batched_ufunc(func, index=None, **kwargs):  # noqa: D202
+    """Make ufunc from function processing all the parameters of a (draw, param) array at once."""
+
+    def _ufunc(ary):
+        target_shape = ary.shape[:-2]
+        samples = np.reshape(ary, (-1, ary.shape[-2] * ary.shape[-1])).T
+        target = np.asarray(func(samples, **kwargs))
+        if index is not None:
+            target = target[..., index]
+        return target.reshape(target_shape)
+
+    return _ufunc
+
+
+def _make_summary_ufunc(credible_interval, extend, include_circ, method, mcse_method):  # noqa: D202
+    """Make the fused ufunc computing all the default statistics of summary at once."""
+
+    def _ufunc(ary):
+        target_shape = ary.shape[:-2]
+        metrics = _summary_metrics(
+            np.reshape(ary, (-1,) + ary.shape[-2:]),
+            credible_interval=credible_interval,
+            extend=extend,
+            include_circ=include_circ,
+            method=method,
+            mcse_method=mcse_method,
+        )
+        return np.stack(metrics, axis=-1).reshape(target_shape + (len(metrics),))
+
+    return _ufunc
+
+
+def _summary_metrics(ary, credible_interval, extend, include_circ, method, mcse_method):
+    """Compute the default statistics of summary for a (params, chain, draw) array.
+
+    The draws of every parameter are flattened once, and sorted once for both HPD bounds.
+    The statistics are returned in the order of the summary columns.
+    """
+    n_params, n_chain, n_draws = ary.shape
+    samples = ary.reshape(n_params, n_chain * n_draws)
+    metrics = []
+    ess = _ess_batched(ary) if n_chain > 1 or (extend and mcse_method == "ess") else None
+
+    if extend:
+        mean = samples.mean(axis=-1, dtype=np.float64)
+        deviation = np.subtract(
+            samples, mean[:, None], dtype=np.result_type(samples.dtype, np.float32)
+        )
+        sd = np.sqrt(
+            np.einsum("ij,ij->i", deviation, deviation, dtype=np.float64) / samples.shape[-1]
+        )
+        del deviation
+        if method == "approx":
+            sketch = QuantileSketch(seed=0)
+            for start in range(0, samples.shape[-1], _APPROX_CHUNK_SIZE):
+                sketch.update(samples[:, start : start + _APPROX_CHUNK_SIZE].T)
+            interval = sketch.hpd(credible_interval=credible_interval)
+        else:
+            interval = _hpd_sorted(
+                np.sort(samples, axis=-1),
+                _hpd_interval_idx_inc(samples.shape[-1], credible_interval),
+            )
+        if mcse_method == "ess":
+            mc_error = sd / np.sqrt(ess)
+        else:
+            mc_error = _batch_means_error(samples, method=mcse_method)
+        metrics.extend([mean, sd, mc_error, interval[:, 0], interval[:, 1]])
+
+    if include_circ:
+        circ_mean = st.circmean(samples, high=np.pi, low=-np.pi, axis=-1)
+        circ_std = st.circstd(samples, high=np.pi, low=-np.pi, axis=-1)
+        centered = samples - circ_mean[:, None]
+        centered = np.sort(np.arctan2(np.sin(centered), np.cos(centered)), axis=-1)
+        interval = _hpd_sorted(
+            centered, _hpd_interval_idx_inc(samples.shape[-1], credible_interval)
+        )
+        del centered
+        interval = interval + circ_mean[:, None]
+        interval = np.arctan2(np.sin(interval), np.cos(interval))
+        circ_error = _batch_means_error(samples, circular=True)
+        metrics.extend([circ_mean, circ_std, circ_error, interval[:, 0], interval[:, 1]])
+
+    if n_chain > 1:
+        metrics.extend([ess, _split_rhat(ary)])
+    return metrics
+
+
+def _wide_summary(var_name, values, order):
+    """Wide data frame of a DataArray with a metric dimension, one row per parameter."""
+    values = values.transpose("metric", *[dim for dim in values.dims if dim != "metric"])
+    shape = values.shape[1:]
+    if not shape:
+        return pd.DataFrame(
+            values.values[None], index=[var_name], columns=list(values.metric.values)
+        )
+    flat_order = "F" if order == "F" else "C"
+    table = np.reshape(values.values, (len(values.metric), -1), order=flat_order)
+    return pd.DataFrame(
+        table.T, index=_wide_labels(var_name, shape, flat_order), columns=list(values.metric.values)
+    )
+
+
+def _wide_labels(var_name, shape, order):
+    """Labels "var_name[i,j,...]" of every parameter of a variable, in C or F order."""
+    indices = np.indices(shape).reshape((len(shape), -1), order=order).astype(str)
+    labels = indices[0]
+    for dim_indices in indices[1:]:
+        labels = np.char.add(np.char.add(labels, ","), dim_indices)
+    return np.char.add(np.char.add(var_name + "[", labels), "]").tolist()
+
+
+def _mc_error(x, batches=5, circular=False, method="batch"):
     """Calculate the simulation standard error, accounting for non-independent samples.
 
     The trace is divided into batches, and the standard deviation of the batch
@@ -915,46 +1321,82 @@ def _mc_error(x, batches=5, circular=False):
     Parameters
     ----------
     x : Numpy array
-        An array containing MCMC samples
+        An array containing MCMC samples, with the draws along the first axis.
     batches : integer
-        Number of batches
+        Number of batches. The draws left over when the length of the trace is not a multiple
+        of `batches` are not used.
     circular : bool
         Whether to compute the error taking into account `x` is a circular variable
         (in the range [-np.pi, np.pi]) or not. Defaults to False (i.e non-circular variables).
+    method : {"batch", "overlapping"}
+        "batch" (default) uses `batches` consecutive batches. "overlapping" uses the means of
+        all the overlapping windows of ``len(x) // batches`` draws, which gives a less variable
+        estimate (Flegal and Jones, 2010). Only "batch" is available for circular variables.
 
     Returns
     -------
     mc_error : float
         Simulation standard error
     """
-    if x.ndim > 1:
-
-        dims = np.shape(x)
-        trace = np.transpose([t.ravel() for t in x])
+    x = np.asarray(x)
+    # (params, draws) view of the trace, every parameter is processed at once
+    samples = np.moveaxis(np.reshape(x, (len(x), -1)), 0, -1)
+    mc_error = _batch_means_error(samples, batches=batches, circular=circular, method=method)
+    return mc_error[0] if x.ndim == 1 else np.reshape(mc_error, x.shape[1:])
+
+
+def _batch_means_error(samples, batches=5, circular=False, method="batch"):
+    """Compute `_mc_error` for every row of a (params, samples) array at once, without copies."""
+    if method not in ("batch", "overlapping"):
+        raise ValueError("Invalid method: '{}'! Options are: 'batch', 'overlapping'".format(method))
+    if circular and method != "batch":
+        raise ValueError("Only the 'batch' method is available for circular variables.")
+    len_x = samples.shape[-1]
+    if batches == 1:
+        if circular:
+            std = st.circstd(samples, high=np.pi, low=-np.pi, axis=-1)
+        else:
+            std = np.std(samples, axis=-1, dtype=np.float64)
+        return std / np.sqrt(len_x)
 
-        return np.reshape([_mc_error(t, batches) for t in trace], dims[1:])
+    batch_len = len_x // batches
+    if method == "overlapping":
+        return _overlapping_batch_means_error(samples, batch_len)
+    if not circular and kernels.NUMBA_AVAILABLE:
+        return kernels.batch_means_std(samples, batches) / np.sqrt(batches)
 
+    # splitting the draw axis in (batches, batch_len) is a view, even of a transposed array
+    batched = samples[:, : batches * batch_len].reshape((len(samples), batches, batch_len))
+    if circular:
+        means = st.circmean(batched, high=np.pi, low=-np.pi, axis=-1)
+        std = st.circstd(means, high=np.pi, low=-np.pi, axis=-1)
     else:
-        if batches == 1:
-            if circular:
-                std = st.circstd(x, high=np.pi, low=-np.pi)
-            else:
-                std = np.std(x)
-            return std / np.sqrt(len(x))
+        std = np.std(batched.mean(axis=-1, dtype=np.float64), axis=-1)
+    return std / np.sqrt(batches)
 
-        batched_traces = np.resize(x, (batches, int(len(x) / batches)))
 
-        if circular:
-            means = st.circmean(batched_traces, high=np.pi, low=-np.pi, axis=1)
-            std = st.circstd(means, high=np.pi, low=-np.pi)
-        else:
-            means = np.mean(batched_traces, 1)
-            std = np.std(means)
-
-        return std / np.sqrt(batches)
+def _overlapping_batch_means_error(samples, batch_len):
+    """Overlapping batch means standard error of every row of a (params, samples) array."""
+    len_x = samples.shape[-1]
+    n_windows = len_x - batch_len + 1
+    # window sums from the cumulative sums of the centered draws
+    cumsum = np.cumsum(
+        samples - samples.mean(axis=-1, keepdims=True, dtype=np.float64), axis=-1, dtype=np.float64
+    )
+    window_means = cumsum[:, batch_len - 1 :]
+    window_means[:, 1:] -= cumsum[:, : n_windows - 1]
+    window_means /= batch_len
+    variance = (
+        len_x
+        * batch_len
+        / ((len_x - batch_len) * n_windows)
+        * np.einsum("ij,ij->i", window_means, window_means)
+    )
+    return np.sqrt(variance / len_x)
 
 
-def waic(data, pointwise=False, scale="deviance"):
+@cached
+def waic(data, pointwise=False, scale="deviance", chunk_size=None):
     """Calculate the widely available information criterion.
 
     Also calculates the WAIC's standard error and the effective number of
@@ -976,6 +1418,9 @@ def waic(data, pointwise=False, scale="deviance"):
         - `deviance` : (default) -2 * (log-score)
         - `log` : 1 * log-score
         - `negative_log` : -1 * (log-score)
+    chunk_size : int, optional
+        Number of observations, along the first observation dimension of the log likelihood,
+        processed at once, see `loo`. Defaults to None, all the observations at once.
 
     Returns
     -------
@@ -1008,12 +1453,13 @@ def waic(data, pointwise=False, scale="deviance"):
         raise TypeError('Valid scale values are "deviance", "log", "negative_log"')
 
     n_samples = log_likelihood.chain.size * log_likelihood.draw.size
-    new_shape = (n_samples,) + log_likelihood.shape[2:]
-    log_likelihood = log_likelihood.values.reshape(*new_shape)
-
-    lppd_i = _logsumexp(log_likelihood, axis=0, b_inv=log_likelihood.shape[0])
-
-    vars_lpd = np.var(log_likelihood, axis=0)
+    lppd_i, vars_lpd = [], []
+    for log_likelihood_chunk in _log_likelihood_chunks(log_likelihood, chunk_size):
+        lppd_i.append(_logsumexp(log_likelihood_chunk, axis=0, b_inv=n_samples))
+        vars_lpd.append(np.var(log_likelihood_chunk, axis=0, dtype=np.float64))
+    obs_shape = log_likelihood.shape[2:]
+    lppd_i = np.concatenate(lppd_i).reshape(obs_shape)
+    vars_lpd = np.concatenate(vars_lpd).reshape(obs_shape)
     warn_mg = 0
     if np.any(vars_lpd > 0.4):
         warnings.warn(
@@ -1045,3 +1491,357 @@ def waic(data, pointwise=False, scale="deviance"):
             data=[waic_sum, waic_se, p_waic, warn_mg, scale],
             index=["waic", "waic_se", "p_waic", "warning", "waic_scale"],
         )
+
+
+def loo_subsample(
+    data,
+    observations=400,
+    approximation="lppd",
+    reff=None,
+    scale="deviance",
+    target_se=None,
+    seed=None,
+    chunk_size=None,
+):
+    """Estimate PSIS-LOO from a random subsample of the observations.
+
+    A cheap approximation of the pointwise elpd is computed for every observation, and the
+    exact PSIS-LOO only for a simple random subsample of them. The elpd is estimated with the
+    difference estimator of Magnusson et al. (2020), which adds to the sum of the
+    approximations the scaled mean difference between the exact and approximated values of
+    the subsample. The better the approximation, the smaller the subsampling error.
+
+    Parameters
+    ----------
+    data : obj
+        Any object that can be converted to an az.InferenceData object with a log_likelihood
+        in its sample_stats group.
+    observations : int, optional
+        Number of observations of the subsample, and of the observations added to it every
+        time `target_se` is not reached. Defaults to 400.
+    approximation : {"lppd", "waic"}, optional
+        Approximation of the pointwise elpd for all the observations, either the log pointwise
+        predictive density or its WAIC correction. Defaults to "lppd".
+    reff : float, optional
+        Relative MCMC efficiency, see `loo`. By default, one value per subsampled observation
+        is computed from its likelihood draws.
+    scale : str
+        Output scale for loo, see `loo`. Defaults to "deviance".
+    target_se : float, optional
+        Subsampling standard error, on the output scale, to reach. Subsampled observations are
+        added `observations` at a time until the error is smaller or all the observations are
+        used. Defaults to None, a single subsample.
+    seed : int, optional
+        Seed of the random subsample.
+    chunk_size : int, optional
+        Number of observations, along the first observation dimension of the log likelihood,
+        approximated at once, see `loo`. Defaults to None, all the observations at once.
+
+    Returns
+    -------
+    pandas.Series with the following columns:
+    loo: estimated Leave-one-out cross-validation
+    loo_se: estimated standard error of loo
+    p_loo: estimated effective number of parameters
+    loo_subsampling_se: standard error of the loo estimate due to subsampling
+    subsample_size: number of observations with exact PSIS-LOO
+    warning: 1 if the estimated shape parameter of Pareto distribution is greater than 0.7
+        for one or more subsampled observations
+    loo_scale: scale of the loo results
+
+    References
+    ----------
+    Magnusson, Andersen, Jonasson and Vehtari (2020). Leave-One-Out Cross-Validation for
+    Bayesian Model Comparison in Large Data. https://arxiv.org/abs/2001.00980
+    """
+    inference_data = convert_to_inference_data(data)
+    if not hasattr(inference_data, "sample_stats"):
+        raise TypeError("Must be able to extract a sample_stats group from data!")
+    if "log_likelihood" not in inference_data.sample_stats:
+        raise TypeError("Data must include log_likelihood in sample_stats")
+    log_likelihood = inference_data.sample_stats.log_likelihood
+
+    if scale.lower() == "deviance":
+        scale_value = -2
+    elif scale.lower() == "log":
+        scale_value = 1
+    elif scale.lower() == "negative_log":
+        scale_value = -1
+    else:
+        raise TypeError('Valid scale values are "deviance", "log", "negative_log"')
+    if approximation not in ("lppd", "waic"):
+        raise ValueError('Valid approximation values are "lppd" and "waic"')
+    observations = int(observations)
+    if observations < 2:
+        raise ValueError("At least 2 observations must be subsampled.")
+
+    n_chains = log_likelihood.chain.size
+    n_samples = n_chains * log_likelihood.draw.size
+    lppd_i, approx_i = [], []
+    for log_likelihood_chunk in _log_likelihood_chunks(log_likelihood, chunk_size):
+        lppd_chunk = _logsumexp(log_likelihood_chunk, axis=0, b_inv=n_samples)
+        lppd_i.append(lppd_chunk)
+        if approximation == "waic":
+            approx_i.append(lppd_chunk - np.var(log_likelihood_chunk, axis=0, dtype=np.float64))
+    lppd_i = np.concatenate(lppd_i)
+    approx_i = lppd_i if approximation == "lppd" else np.concatenate(approx_i)
+    n_obs = len(approx_i)
+    approx_sums = (np.sum(approx_i), np.sum(approx_i ** 2))
+
+    order = np.random.RandomState(seed).permutation(n_obs)
+    loo_i = np.full(n_obs, np.nan)
+    pareto_shape = np.full(n_obs, np.nan)
+    n_subsample = 0
+    while n_subsample < n_obs:
+        idx = np.sort(order[n_subsample : n_subsample + observations])
+        n_subsample += len(idx)
+        log_likelihood_chunk = _log_likelihood_subsample(log_likelihood, idx)
+        if reff is None:
+            reff_chunk = 1.0 if n_chains == 1 else _loo_reff(log_likelihood_chunk, n_chains)
+        else:
+            reff_chunk = reff
+        log_weights, pareto_shape[idx] = psislw(-log_likelihood_chunk, reff_chunk)
+        log_weights += log_likelihood_chunk
+        loo_i[idx] = _logsumexp(log_weights, axis=0)
+        del log_weights
+
+        subsample = order[:n_subsample]
+        elpd, elpd_var, elpd_sq_dev = _difference_estimate(
+            n_obs, approx_sums, loo_i[subsample], approx_i[subsample]
+        )
+        if target_se is None or abs(scale_value) * elpd_var ** 0.5 <= target_se:
+            break
+
+    warn_mg = 0
+    if np.any(pareto_shape[subsample] > 0.7):
+        warnings.warn(
+            """Estimated shape parameter of Pareto distribution is greater than 0.7 for
+        one or more subsampled observations. You should consider using a more robust model,
+        see `loo`."""
+        )
+        warn_mg = 1
+
+    return pd.Series(
+        data=[
+            scale_value * elpd,
+            abs(scale_value) * max(elpd_sq_dev, 0) ** 0.5,
+            np.sum(lppd_i) - elpd,
+            abs(scale_value) * elpd_var ** 0.5,
+            n_subsample,
+            warn_mg,
+            scale,
+        ],
+        index=[
+            "loo",
+            "loo_se",
+            "p_loo",
+            "loo_subsampling_se",
+            "subsample_size",
+            "warning",
+            "loo_scale",
+        ],
+    )
+
+
+def _difference_estimate(n_obs, approx_sums, elpd_sub, approx_sub):
+    """Difference estimator of the elpd from a simple random subsample without replacement.
+
+    Parameters
+    ----------
+    n_obs : int
+        Total number of observations.
+    approx_sums : tuple of float
+        Sum of the approximated pointwise elpd of all the observations, and of its squares.
+    elpd_sub, approx_sub : Numpy array
+        Exact and approximated pointwise elpd of the subsampled observations.
+
+    Returns
+    -------
+    elpd : float
+        Estimated elpd.
+    elpd_var : float
+        Subsampling variance of the estimate.
+    elpd_sq_dev : float
+        Estimated sum of squared deviations of the pointwise elpd from their mean, whose
+        square root is the standard error of the elpd reported by `loo`.
+    """
+    n_sub = len(elpd_sub)
+    diff = elpd_sub - approx_sub
+    elpd = approx_sums[0] + n_obs * np.mean(diff)
+    elpd_var = n_obs ** 2 * (1 - n_sub / n_obs) * np.var(diff, ddof=1) / n_sub
+    # E[elpd ** 2] = elpd_total ** 2 + elpd_var
+    sq_sum = approx_sums[1] + n_obs * np.mean(elpd_sub ** 2 - approx_sub ** 2)
+    elpd_sq_dev = sq_sum - (elpd ** 2 - elpd_var) / n_obs
+    return elpd, elpd_var, elpd_sq_dev
+
+
+def _log_likelihood_subsample(log_likelihood, idx):
+    """Log likelihood of the observations at flat indices `idx`, as a (samples, obs) array."""
+    n_samples = log_likelihood.chain.size * log_likelihood.draw.size
+    obs_dims = log_likelihood.dims[2:]
+    if not obs_dims:
+        return log_likelihood.values.reshape((n_samples, 1))
+    indexers = {
+        dim: xr.DataArray(dim_idx, dims="__obs__")
+        for dim, dim_idx in zip(obs_dims, np.unravel_index(idx, log_likelihood.shape[2:]))
+    }
+    subsample = log_likelihood.isel(indexers).transpose("chain", "draw", "__obs__")
+    return subsample.values.reshape((n_samples, -1))
+
+
+def _loo_reff(log_likelihood, n_chains):
+    """Relative efficiency of every observation of a (samples, observations) log likelihood.
+
+    The effective sample size of the likelihood draws of every observation is computed at
+    once, with the autocovariances truncated where Geyer's sequence stops. The likelihood is
+    scaled by its maximum per observation, which does not change the efficiency but avoids
+    overflows.
+    """
+    n_samples, n_obs = log_likelihood.shape
+    likelihood = np.exp(log_likelihood - np.max(log_likelihood, axis=0))
+    draws = likelihood.T.reshape((n_obs, n_chains, n_samples // n_chains))
+    reff = _ess_batched(draws) / n_samples
+    # constant likelihoods have no defined efficiency, they are not smoothed anyway
+    return np.where(np.isfinite(reff) & (reff > 0), reff, 1.0)
+
+
+def _log_likelihood_chunks(log_likelihood, chunk_size=None):
+    """Yield the log likelihood as (samples, observations) arrays, a chunk at a time.
+
+    Parameters
+    ----------
+    log_likelihood : xarray.DataArray
+        Log likelihood with (chain, draw, *observations) dimensions.
+    chunk_size : int, optional
+        Number of elements of the first observation dimension in every chunk. Defaults to
+        None, a single chunk.
+
+    Yields
+    ------
+    Numpy array
+        Log likelihood of the chunk with shape (samples, observations). The observation
+        dimensions are flattened in C order, so concatenating the pointwise results of the
+        chunks and reshaping them to the observation shape recovers their layout.
+    """
+    n_samples = log_likelihood.chain.size * log_likelihood.draw.size
+    obs_dims = log_likelihood.dims[2:]
+    if chunk_size is None or not obs_dims:
+        yield log_likelihood.values.reshape((n_samples, -1))
+        return
+    chunk_size = int(chunk_size)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    for start in range(0, log_likelihood.sizes[obs_dims[0]], chunk_size):
+        chunk = log_likelihood.isel({obs_dims[0]: slice(start, start + chunk_size)})
+        yield chunk.values.reshape((n_samples, -1))
+
+
+def diagnose_many(paths, diagnostics=("summary",), var_names=None, n_jobs=1):
+    """Compute diagnostics for many InferenceData objects saved as netcdf files.
+
+    The files are processed one at a time by each worker of a process pool, and only the
+    groups and variables needed by the requested diagnostics are read from disk, so the
+    memory used by a worker is bounded by the size of the largest fit.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        Locations of netcdf files written with `InferenceData.to_netcdf`.
+    diagnostics : sequence of {"summary", "rhat", "ess", "loo"}
+        Diagnostics to compute for every file. "summary" includes the effective sample size
+        and R-hat, "loo" requires a `log_likelihood` variable in the `sample_stats` group.
+        Defaults to ("summary",).
+    var_names : list, optional
+        Names of the posterior variables to include in "summary", "rhat" and "ess". Defaults
+        to None, all of them.
+    n_jobs : int, optional
+        Number of worker processes, -1 uses all the available cores. Defaults to 1, the
+        files are then processed serially in the current process. Workers are started with
+        the "spawn" method, so scripts using them need an ``if __name__ == "__main__":`` guard.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Tidy DataFrame with columns `file`, `variable`, `metric` and `value`, in the order of
+        `paths`. Variables are labeled like the rows of `summary`, and the `loo` metrics have
+        the `log_likelihood` variable.
+
+    Examples
+    --------
+    .. code:: ipython
+
+        >>> df = az.diagnose_many(glob.glob("fits/*.nc"), ["rhat", "ess"], n_jobs=-1)
+        >>> df.pivot_table(index="file", columns="metric", values="value", aggfunc="max")
+    """
+    valid_diagnostics = ("summary", "rhat", "ess", "loo")
+    diagnostics = [diagnostics] if isinstance(diagnostics, str) else list(diagnostics)
+    for diagnostic in diagnostics:
+        if diagnostic not in valid_diagnostics:
+            raise ValueError(
+                "Invalid diagnostic: '{}'! Options are: {}".format(diagnostic, valid_diagnostics)
+            )
+
+    paths = [str(path) for path in paths]
+    n_jobs = get_n_jobs(n_jobs)
+    if n_jobs == 1:
+        frames = [_diagnose_file(path, diagnostics, var_names) for path in paths]
+    else:
+        # workers are spawned, forking a process that already runs compiled parallel kernels
+        # or holds open netcdf files is not safe
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+            frames = list(
+                executor.map(_diagnose_file, paths, repeat(diagnostics), repeat(var_names))
+            )
+    if not frames:
+        return pd.DataFrame(columns=["file", "variable", "metric", "value"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _diagnose_file(path, diagnostics, var_names):
+    """Compute the diagnostics of a single netcdf file, as a tidy DataFrame."""
+    # each group is only read when a requested diagnostic uses it
+    selected = None
+    if any(diagnostic in ("summary", "rhat", "ess") for diagnostic in diagnostics):
+        selected = _load_netcdf_group(path, "posterior", var_names)
+
+    rows = []
+    for diagnostic in diagnostics:
+        if diagnostic == "summary":
+            summary_df = summary(selected, round_to=None)
+            for variable, metrics in summary_df.iterrows():
+                rows.extend((variable, metric, value) for metric, value in metrics.items())
+        elif diagnostic in ("rhat", "ess"):
+            func = rhat if diagnostic == "rhat" else effective_sample_size
+            rows.extend(_dataset_rows(func(selected), diagnostic))
+        else:
+            sample_stats = _load_netcdf_group(path, "sample_stats", ["log_likelihood"])
+            # loo never uses the posterior variables
+            loo_data = InferenceData(posterior=xr.Dataset(), sample_stats=sample_stats)
+            loo_series = loo(loo_data)
+            rows.extend(
+                ("log_likelihood", metric, loo_series[metric])
+                for metric in ("loo", "loo_se", "p_loo", "warning")
+            )
+
+    df = pd.DataFrame(rows, columns=["variable", "metric", "value"])
+    df.insert(0, "file", path)
+    return df
+
+
+def _load_netcdf_group(path, group, var_names=None):
+    """Read the selected variables of a group of a netcdf file into memory."""
+    with xr.open_dataset(path, group=group) as dataset:
+        var_names = _var_names(var_names, dataset)
+        if var_names is not None:
+            dataset = dataset[var_names]
+        return dataset.load()
+
+
+def _dataset_rows(dataset, metric):
+    """Flatten a Dataset of scalar diagnostics to (variable, metric, value) rows."""
+    for var_name, values in dataset.data_vars.items():
+        ary = values.values
+        for idx in np.ndindex(ary.shape):
+            label = "{}[{}]".format(var_name, ",".join(map(str, idx))) if idx else var_name
+            yield label, metric, ary[idx]
@@ -0,0 +1,121 @@
+"""Stats-utility functions for ArviZ."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from . import kernels
+
+
+def get_n_jobs(n_jobs):
+    """Handle the n_jobs argument across arviz.
+
+    Parameters
+    ----------
+    n_jobs : int or None
+        Number of workers. None means 1, negative values count back from the number of
+        available cores, -1 using all of them.
+
+    Returns
+    -------
+    n_jobs : int
+    """
+    if n_jobs is None:
+        return 1
+    n_jobs = int(n_jobs)
+    if n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning, use n_jobs=1 to run serially.")
+    return n_jobs
+
+
+def wrap_xarray_ufunc(ufunc, dataset, n_jobs=1, output_sizes=None):
+    """Apply a ufunc over the (chain, draw) dimensions of every variable of a Dataset.
+
+    Parameters
+    ----------
+    ufunc : callable
+        Function taking an array of shape (..., chain, draw) and returning an array of
+        shape (...). The leading dimensions must be independent from each other.
+    dataset : xarray.Dataset
+    n_jobs : int, optional
+        Number of threads used. The variables and blocks of their parameters are split
+        across a thread pool, which is effective because the NumPy and FFT kernels used by
+        the diagnostics release the GIL. Defaults to 1, see `get_n_jobs`. With numba
+        installed, `n_jobs=1` already runs the compiled kernels in parallel on all the cores
+        with numba's own threads; with `n_jobs > 1` every thread of the pool uses serial
+        kernels instead, so the two levels of parallelism are never nested.
+    output_sizes : dict, optional
+        Names and sizes of trailing dimensions added by the ufunc, whose output then has
+        shape (..., *output_sizes.values()). Defaults to None, no new dimensions.
+
+    Returns
+    -------
+    xarray.Dataset
+        Lazy if any variable of `dataset` is a dask array.
+
+    Notes
+    -----
+    Dask backed datasets are never loaded into memory, the ufunc is applied lazily and in
+    parallel to every chunk by dask, and `n_jobs` is ignored. Chunks can span any of the
+    parameter dimensions, chain and draw are merged into a single chunk if needed. Dask
+    tasks also use the serial numba kernels.
+
+    Numba parallel regions launched concurrently from several threads abort the process
+    with numba's ``workqueue`` threading layer, the default one when neither TBB nor OpenMP
+    are installed, which is why the pool threads and dask tasks never launch them.
+    """
+    output_sizes = {} if output_sizes is None else dict(output_sizes)
+    output_core_dims = (tuple(output_sizes),)
+    if is_dask_dataset(dataset):
+        dataset = dataset.chunk({"chain": dataset.chain.size, "draw": dataset.draw.size})
+        return xr.apply_ufunc(
+            kernels.serial(ufunc),
+            dataset,
+            input_core_dims=(("chain", "draw"),),
+            output_core_dims=output_core_dims,
+            dask="parallelized",
+            output_dtypes=[float],
+            output_sizes=output_sizes or None,
+        )
+
+    n_jobs = get_n_jobs(n_jobs)
+    if n_jobs == 1:
+        return xr.apply_ufunc(
+            ufunc,
+            dataset,
+            input_core_dims=(("chain", "draw"),),
+            output_core_dims=output_core_dims,
+        )
+
+    template = dataset.isel(chain=0, draw=0, drop=True)
+    tasks = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for var_name in dataset.data_vars:
+            dims = template[var_name].dims
+            ary = dataset[var_name].transpose(*dims, "chain", "draw").values
+            ary = ary.reshape((-1,) + ary.shape[-2:])
+            blocks = np.array_split(ary, max(min(n_jobs, len(ary)), 1))
+            futures = [executor.submit(kernels.serial(ufunc), block) for block in blocks]
+            tasks.append((var_name, dims, template[var_name].shape, futures))
+
+        results = {
+            var_name: (
+                dims + tuple(output_sizes),
+                np.concatenate([future.result() for future in futures]).reshape(
+                    shape + tuple(output_sizes.values())
+                ),
+            )
+            for var_name, dims, shape, futures in tasks
+        }
+    return xr.Dataset(results, coords=template.coords)
+
+
+def is_dask_dataset(dataset):
+    """Check whether any variable of a Dataset is backed by a dask array."""
+    return any(
+        getattr(dataset[var_name].data, "chunks", None) is not None
+        for var_name in dataset.data_vars
+    )
@@ -29,7 +29,7 @@ from arviz import (
     clear_data_home,
     InferenceData,
 )
-from ..data.base import generate_dims_coords, make_attrs
+from ..data.base import dict_to_dataset, generate_dims_coords, make_attrs
 from ..data.io_pystan import get_draws, get_draws_stan3  # pylint: disable=unused-import
 from ..data.datasets import REMOTE_DATASETS, LOCAL_DATASETS, RemoteFileMetadata
 from .helpers import (  # pylint: disable=unused-import
@@ -373,6 +373,12 @@ def test_dict_to_dataset():
     assert set(dataset.b.coords) == {"chain", "draw", "c"}
 
 
+def test_dict_to_dataset_dtype():
+    datadict = {"a": np.random.randn(4, 100), "b": np.random.randn(4, 100, 10)}
+    dataset = dict_to_dataset(datadict, dtype=np.float32)
+    assert all(dataset[var_name].dtype == np.float32 for var_name in dataset.data_vars)
+
+
 def test_convert_to_dataset_idempotent():
     first = convert_to_dataset(np.random.randn(100))
     second = convert_to_dataset(first)
@@ -1,11 +1,33 @@
 """Test Diagnostic methods"""
 # pylint: disable=redefined-outer-name, no-member
+import os
+import subprocess
+import sys
+
 import numpy as np
 import pytest
+from scipy.stats import norm, rankdata
+import xarray as xr
 
-from ..data import load_arviz_data
-from ..stats import rhat, effective_sample_size, geweke
-from ..stats.diagnostics import ks_summary
+from ..data import load_arviz_data, from_dict
+from ..stats import (
+    rhat,
+    effective_sample_size,
+    geweke,
+    autocorr,
+    rank_diagnostics,
+    ConvergenceMonitor,
+    PartialDiagnostics,
+)
+from ..stats.diagnostics import (
+    ks_summary,
+    _ess_ufunc,
+    _get_ess,
+    _autocov,
+    _rhat_ufunc,
+    _get_split_rhat,
+    _ess_batched,
+)
 
 
 GOOD_RHAT = 1.1
@@ -35,9 +57,61 @@ class TestDiagnostics:
         r_hat = rhat(np.vstack([20 + np.random.randn(1, 100), np.random.randn(1, 100)]))
         assert 1 / GOOD_RHAT > r_hat or GOOD_RHAT < r_hat
 
-    def test_rhat_bad_shape(self):
-        with pytest.raises(TypeError):
-            rhat(np.random.randn(3))
+    def test_rhat_batched(self):
+        ary = np.random.randn(3, 2, 4, 101)
+        ary[0, 1] += np.arange(4)[:, None]
+        r_hat = _rhat_ufunc(ary)
+        assert r_hat.shape == (3, 2)
+        for idx in np.ndindex(r_hat.shape):
+            assert np.isclose(r_hat[idx], _get_split_rhat(ary[idx]))
+        assert r_hat[0, 1] > GOOD_RHAT
+
+    def test_rhat_round_to(self, data):
+        r_hat = rhat(data, round_to=2)
+        assert np.allclose(r_hat.mu, rhat(data).mu, atol=0.005)
+        ary = np.random.randn(4, 100)
+        assert rhat(ary, round_to=2) == round(rhat(ary), 2)
+
+    @pytest.mark.parametrize("n_jobs", (2, -1))
+    def test_rhat_n_jobs(self, data, n_jobs):
+        assert rhat(data, n_jobs=n_jobs).equals(rhat(data))
+
+    @pytest.mark.parametrize("method", ["split", "rank"])
+    def test_rhat_bad_shape(self, method):
+        with pytest.raises(TypeError, match="R-hat"):
+            rhat(np.random.randn(3), method=method)
+
+    def test_rank_diagnostics(self, data):
+        ary = np.random.standard_t(2, size=(4, 301))
+        ary[1] = np.round(ary[1])
+        split = np.concatenate((ary[:, :150], ary[:, -150:]))
+        ranks = rankdata(split).reshape(split.shape)
+        z_scores = norm.ppf((ranks - 0.375) / (split.size + 0.25))
+        assert np.isclose(
+            effective_sample_size(ary, method="bulk"), _ess_batched(z_scores[None])[0]
+        )
+        tail_ess = min(
+            _ess_batched(split[None] <= np.quantile(split, prob))[0] for prob in (0.05, 0.95)
+        )
+        assert np.isclose(effective_sample_size(ary, method="tail"), tail_ess)
+        assert rhat(ary, method="rank") >= rhat(z_scores)
+
+        diagnostics = rank_diagnostics(data)
+        assert list(diagnostics.metric.values) == ["r_hat_rank", "ess_bulk", "ess_tail"]
+        xr.testing.assert_allclose(
+            diagnostics.sel(metric="r_hat_rank", drop=True), rhat(data, method="rank")
+        )
+        for method in ("bulk", "tail"):
+            xr.testing.assert_allclose(
+                diagnostics.sel(metric="ess_" + method, drop=True),
+                effective_sample_size(data, method=method),
+            )
+        scaled = np.random.randn(4, 200) * np.array([[1], [1], [1], [10]])
+        assert rhat(scaled, method="rank") > rhat(scaled)
+        with pytest.raises(ValueError):
+            rhat(data, method="bad")
+        with pytest.raises(ValueError):
+            effective_sample_size(data, method="bad")
 
     def test_effective_sample_size_array(self):
         ess_hat = effective_sample_size(np.random.randn(4, 100))
@@ -52,11 +126,189 @@ class TestDiagnostics:
         with pytest.raises(TypeError):
             effective_sample_size(np.random.randn(1, 3))
 
+    def test_effective_sample_size_batched(self):
+        ary = np.random.randn(3, 2, 4, 100)
+        ary[0, 1] = np.cumsum(ary[0, 1], axis=-1)
+        ess_hat = _ess_ufunc(ary)
+        assert ess_hat.shape == (3, 2)
+        for idx in np.ndindex(ess_hat.shape):
+            assert ess_hat[idx] == _get_ess(ary[idx])
+
+    @pytest.mark.parametrize("n_jobs", (2, -1))
+    def test_effective_sample_size_n_jobs(self, data, n_jobs):
+        ess_hat = effective_sample_size(data, n_jobs=n_jobs)
+        assert ess_hat.equals(effective_sample_size(data))
+
+    def test_effective_sample_size_constant(self):
+        assert np.isnan(effective_sample_size(np.ones((4, 100))))
+
+    @pytest.mark.parametrize("method", ("fft", "direct"))
+    def test_diagnostics_float32(self, method):
+        ary = (np.random.randn(5, 4, 1000) + 100).astype(np.float32)
+        assert np.allclose(
+            _autocov(ary, max_lag=10, method=method),
+            _autocov(ary.astype(np.float64), max_lag=10, method=method),
+            atol=1e-6,
+        )
+        assert np.allclose(_rhat_ufunc(ary), _rhat_ufunc(ary.astype(np.float64)), rtol=1e-6)
+        assert np.allclose(_ess_ufunc(ary), _ess_ufunc(ary.astype(np.float64)), atol=1)
+
+    @pytest.mark.parametrize("axis", (0, 1, -1))
+    def test_autocov_axis(self, axis):
+        ary = np.random.randn(3, 50, 4)
+        acov = _autocov(ary, axis=axis)
+        assert acov.shape == ary.shape
+        series = np.moveaxis(ary, axis, -1)[0, 0]
+        assert np.allclose(np.moveaxis(acov, axis, -1)[0, 0], _autocov(series))
+        centered = series - series.mean()
+        expected = [np.var(series), np.mean(centered[1:] * centered[:-1])]
+        assert np.allclose(_autocov(series)[:2], expected)
+
+    @pytest.mark.parametrize("max_lag", (None, 0, 5, 200))
+    @pytest.mark.parametrize("method", ("auto", "fft", "direct"))
+    def test_autocorr(self, max_lag, method):
+        ary = np.random.randn(3, 100, 2)
+        acorr = autocorr(ary, axis=1, max_lag=max_lag, method=method)
+        n_lags = 100 if max_lag is None else min(max_lag + 1, 100)
+        assert acorr.shape == (3, n_lags, 2)
+        assert np.allclose(acorr[:, 0], 1)
+        assert np.allclose(acorr, autocorr(ary, axis=1, method="fft")[:, :n_lags])
+        assert np.allclose(acorr[1, :, 0], autocorr(ary[1, :, 0])[:n_lags])
+
+    def test_autocorr_bad_method(self):
+        with pytest.raises(ValueError):
+            autocorr(np.random.randn(100), method="bad_method")
+
     @pytest.mark.parametrize("var_names", (None, "mu", ["mu", "tau"]))
     def test_effective_sample_size_dataset(self, data, var_names):
         ess_hat = effective_sample_size(data, var_names=var_names)
         assert ess_hat.mu > 100  # This might break if the data is regenerated
 
+    @pytest.mark.parametrize("blocks", ([100, 400], [1, 3, 7, 89, 400]))
+    def test_convergence_monitor_array(self, blocks):
+        ary = np.cumsum(np.random.randn(4, sum(blocks), 3), axis=1) / 10 + 100
+        monitor = ConvergenceMonitor(max_lag=sum(blocks))
+        start = 0
+        for block in blocks:
+            monitor.update(ary[:, start : start + block])
+            start += block
+        assert monitor.n_draws == sum(blocks)
+        assert np.allclose(monitor.rhat(), _rhat_ufunc(np.moveaxis(ary, (0, 1), (-2, -1))))
+        assert np.allclose(
+            monitor.effective_sample_size(), _ess_ufunc(np.moveaxis(ary, (0, 1), (-2, -1)))
+        )
+
+    def test_convergence_monitor_split(self):
+        ary = np.random.randn(4, 3001, 2)
+        ary[:2] += np.linspace(0, 1, 3001)[:, None]
+        monitor = ConvergenceMonitor()
+        for start in range(0, 3001, 7):
+            monitor.update(ary[:, start : start + 7])
+            # the moments of the split halves take a bounded amount of memory
+            assert monitor._states[None].bins.means.shape == (256, 4, 2)
+        assert monitor.n_draws == 3001
+        # the split point is rounded to a bin edge, a few draws away from the middle
+        assert np.allclose(
+            monitor.rhat(), _rhat_ufunc(np.moveaxis(ary, (0, 1), (-2, -1))), rtol=1e-3
+        )
+        monitor.update(ary[:, :999])
+        assert np.allclose(
+            monitor.rhat(),
+            _rhat_ufunc(np.moveaxis(np.concatenate((ary, ary[:, :999]), 1), (0, 1), (-2, -1))),
+        )
+
+    def test_convergence_monitor_max_lag(self):
+        ary = np.cumsum(np.random.randn(4, 1001, 3), axis=1)
+        monitor = ConvergenceMonitor(max_lag=30)
+        monitor.update(ary)
+        with pytest.warns(UserWarning, match="max_lag=30"):
+            ess = monitor.effective_sample_size()
+        assert np.isnan(ess).all()
+        monitor = ConvergenceMonitor(max_lag=1001)
+        monitor.update(ary)
+        assert np.allclose(
+            monitor.effective_sample_size(), _ess_ufunc(np.moveaxis(ary, (0, 1), (-2, -1)))
+        )
+
+    def test_convergence_monitor_dataset(self, data):
+        monitor = ConvergenceMonitor(max_lag=data.draw.size)
+        monitor.update(data.isel(draw=slice(None, 200)))
+        monitor.update(data.isel(draw=slice(200, None)))
+        for var_name, r_hat in rhat(data).data_vars.items():
+            assert np.allclose(monitor.rhat()[var_name], r_hat)
+        for var_name, ess in effective_sample_size(data).data_vars.items():
+            assert np.allclose(monitor.effective_sample_size()[var_name], ess)
+
+    def test_convergence_monitor_bad(self):
+        monitor = ConvergenceMonitor()
+        with pytest.raises(ValueError):
+            monitor.rhat()
+        monitor.update(from_dict({"a": np.random.randn(4, 10)}))
+        with pytest.raises(ValueError):
+            monitor.update(from_dict({"b": np.random.randn(4, 10)}))
+        with pytest.raises(TypeError):
+            monitor.update(np.random.randn(4))
+
+    def test_partial_diagnostics(self, data):
+        partials = [PartialDiagnostics(data.isel(chain=[chain]), max_lag=500) for chain in range(4)]
+        merged = partials[0].merge(*partials[1:])
+        assert merged.n_chains == 4
+        xr.testing.assert_allclose(merged.rhat(), rhat(data))
+        xr.testing.assert_allclose(merged.effective_sample_size(), effective_sample_size(data))
+        expected_mcse = data.std(dim=("chain", "draw")) / np.sqrt(effective_sample_size(data))
+        xr.testing.assert_allclose(merged.mcse(), expected_mcse)
+        with pytest.raises(TypeError):
+            partials[0].effective_sample_size()
+        with pytest.raises(ValueError):
+            partials[0].merge(PartialDiagnostics(data.isel(chain=[1], draw=slice(100))))
+        ary = np.random.randn(4, 100)
+        partial = PartialDiagnostics(ary[:2]).merge(PartialDiagnostics(ary[2:]))
+        assert np.isclose(partial.rhat(), rhat(ary))
+
+    def test_partial_diagnostics_max_lag(self):
+        ary = np.cumsum(np.random.randn(4, 1001, 3), axis=1)
+        ary[..., 0] = np.random.randn(4, 1001)
+        partial = PartialDiagnostics(ary[:2], max_lag=30).merge(
+            PartialDiagnostics(ary[2:], max_lag=30)
+        )
+        with pytest.warns(UserWarning, match="2 of 3 parameters"):
+            ess = partial.effective_sample_size()
+        assert np.isnan(ess[1:]).all()
+        assert np.isclose(ess[0], _ess_ufunc(np.moveaxis(ary[..., :1], (0, 1), (-2, -1)))[0])
+        with pytest.warns(UserWarning):
+            mcse = partial.mcse()
+        assert np.isnan(mcse[1:]).all() and np.isfinite(mcse[0])
+
+    def test_diagnostics_dask(self, data):
+        pytest.importorskip("dask")
+        chunked = data.chunk({"school": 3})
+        for diagnostic in (rhat, effective_sample_size):
+            result = diagnostic(chunked)
+            assert result.theta.chunks is not None
+            xr.testing.assert_allclose(result.compute(), diagnostic(data))
+
+    def test_diagnostics_threads_workqueue(self):
+        """Thread pools must not launch numba parallel regions with the workqueue layer."""
+        pytest.importorskip("numba")
+        code = (
+            "import arviz as az\n"
+            "posterior = az.load_arviz_data('centered_eight').posterior\n"
+            "az.rhat(posterior, n_jobs=8)\n"
+            "az.effective_sample_size(posterior, n_jobs=8)\n"
+            "az.summary(posterior, n_jobs=8)\n"
+        )
+        env = dict(os.environ, NUMBA_THREADING_LAYER="workqueue")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=root,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+        assert result.returncode == 0, result.stderr.decode()
+
     def test_geweke(self):
         first = 0.1
         last = 0.5
@@ -71,6 +323,17 @@ class TestDiagnostics:
         assert gw_stat.shape[0] == intervals
         assert 10000 * last - gw_stat[:, 0].max() == 1
 
+    def test_geweke_dataset(self, data):
+        gw_stat = geweke(data, intervals=10, var_names=["mu", "theta"])
+        assert list(gw_stat.data_vars) == ["mu", "theta"]
+        assert gw_stat.theta.dims == ("chain", "school", "interval")
+        assert gw_stat.interval.size == 10
+        values = data.theta.sel(chain=1, school="Choate").values
+        assert np.allclose(
+            gw_stat.theta.sel(chain=1, school="Choate"), geweke(values, intervals=10)[:, 1]
+        )
+        assert np.allclose(gw_stat.interval, geweke(values, intervals=10)[:, 0])
+
     def test_geweke_bad_interval(self):
         # lower bound
         with pytest.raises(ValueError):
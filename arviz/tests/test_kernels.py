@@ -0,0 +1,54 @@
+"""Tests for the compiled kernels, checked against the NumPy implementations."""
+# pylint: disable=redefined-outer-name
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+import pytest
+
+from ..stats import kernels
+from ..stats.diagnostics import _ess_batched, _split_rhat
+from ..stats.stats import hpd, psislw, _mc_error
+
+pytest.importorskip("numba")
+
+
+@pytest.fixture(scope="module")
+def draws():
+    ary = np.random.randn(20, 4, 300).cumsum(axis=-1) * 0.1 + np.random.randn(20, 4, 300)
+    ary[0] = 1.0
+    ary[1, 0, 3] = np.nan
+    return ary
+
+
+def run_numpy_and_numba(monkeypatch, func, *args, **kwargs):
+    monkeypatch.setattr(kernels, "NUMBA_AVAILABLE", False)
+    numpy_result = func(*args, **kwargs)
+    monkeypatch.setattr(kernels, "NUMBA_AVAILABLE", True)
+    return numpy_result, func(*args, **kwargs)
+
+
+@pytest.mark.parametrize("func", [_ess_batched, _split_rhat])
+def test_diagnostic_kernels(monkeypatch, draws, func):
+    numpy_result, numba_result = run_numpy_and_numba(monkeypatch, func, draws)
+    assert_allclose(numba_result, numpy_result, rtol=1e-12)
+
+
+@pytest.mark.parametrize("func", [hpd, _mc_error])
+def test_summary_kernels(monkeypatch, draws, func):
+    ary = draws[2:, 0].T
+    numpy_result, numba_result = run_numpy_and_numba(monkeypatch, func, ary)
+    assert_allclose(numba_result, numpy_result, rtol=1e-12)
+
+
+def test_hpd_kernel_too_few_elements(monkeypatch):
+    monkeypatch.setattr(kernels, "NUMBA_AVAILABLE", True)
+    with pytest.raises(ValueError):
+        hpd(np.random.randn(10, 2), credible_interval=1)
+
+
+def test_psis_kernel(monkeypatch):
+    log_weights = np.random.standard_t(3, size=(1000, 20)) * 2
+    log_weights[:, 0] = 0
+    (numpy_lw, numpy_k), (numba_lw, numba_k) = run_numpy_and_numba(monkeypatch, psislw, log_weights)
+    assert_allclose(numba_lw, numpy_lw, rtol=1e-10)
+    assert_allclose(numba_k, numpy_k, rtol=1e-10)
+    assert_array_equal(np.isinf(numba_k), np.isinf(numpy_k))
@@ -682,6 +682,7 @@ def test_plot_rank(models, model_fit, kwargs):
         {"ref_val": {"mu": [{"ref_val": 1}]}},
         {"bins": None, "kind": "hist"},
         {"mu": {"ref_val": (-1, 1)}},
+        {"method": "approx", "point_estimate": "median"},
     ],
 )
 @pytest.mark.parametrize("model_fit", ["pymc3_fit", "stan_fit", "pyro_fit"])
@@ -706,6 +707,8 @@ def test_plot_posterior_bad(models, model_fit):
         plot_posterior(obj, ref_val="bad_value")
     with pytest.raises(ValueError):
         plot_posterior(obj, point_estimate="bad_value")
+    with pytest.raises(ValueError):
+        plot_posterior(obj, method="bad_value")
 
 
 @pytest.mark.parametrize("model_fit", ["pymc3_fit", "stan_fit", "pyro_fit"])
@@ -5,11 +5,32 @@ from numpy.testing import assert_almost_equal, assert_array_almost_equal
 import pytest
 from scipy.special import logsumexp
 from scipy.stats import linregress
-
-
-from ..data import load_arviz_data, from_dict
-from ..stats import bfmi, compare, hpd, loo, r2_score, waic, psislw, summary
-from ..stats.stats import _gpinv, _mc_error, _logsumexp
+import xarray as xr
+
+
+from ..data import load_arviz_data, from_dict, from_netcdf
+from ..stats import (
+    bfmi,
+    clear_cache,
+    compare,
+    diagnose_many,
+    disable_cache,
+    enable_cache,
+    hpd,
+    IncrementalSummary,
+    loo,
+    loo_subsample,
+    psislw,
+    QuantileSketch,
+    r2_score,
+    rhat,
+    summary,
+    waic,
+)
+from ..stats import cache, kernels
+from ..stats import stats as stats_module
+from ..stats.diagnostics import _autocov, _ess_from_acov
+from ..stats.stats import _gpdfit, _gpinv, _mc_error, _logsumexp
 
 
 @pytest.fixture(scope="session")
@@ -35,6 +56,52 @@ def test_hpd():
     assert_array_almost_equal(interval, [-1.88, 1.88], 2)
 
 
+@pytest.mark.parametrize("circular", [False, True])
+def test_hpd_axis(circular):
+    ary = np.random.randn(3, 1000, 4)
+    interval = hpd(ary, circular=circular, axis=1)
+    assert interval.shape == (3, 4, 2)
+    for idx in np.ndindex(3, 4):
+        expected = hpd(ary[idx[0], :, idx[1]], circular=circular)
+        assert_array_almost_equal(interval[idx], expected)
+
+
+def test_quantile_sketch():
+    ary = np.random.randn(100000, 3)
+    sketch = QuantileSketch(error=0.005, seed=0)
+    for chunk in np.array_split(ary, 7):
+        sketch.update(chunk)
+    probs = [0.05, 0.5, 0.95]
+    # estimates fall within a few rank errors of the exact quantiles
+    assert_array_almost_equal(sketch.quantile(probs), np.quantile(ary, probs, axis=0), 1)
+    for col, (lower, upper) in enumerate(sketch.hpd()):
+        coverage = np.mean((ary[:, col] >= lower) & (ary[:, col] <= upper))
+        assert abs(coverage - 0.94) < 0.02
+        assert_array_almost_equal([lower, upper], hpd(ary[:, col]), 1)
+
+
+def test_quantile_sketch_merge():
+    ary = np.random.randn(20000, 2, 2)
+    sketches = [QuantileSketch(seed=0).update(chunk) for chunk in np.array_split(ary, 4)]
+    merged = sketches[0].merge(*sketches[1:])
+    assert merged.n_draws == 20000
+    assert merged.quantile(0.5).shape == (2, 2)
+    assert merged.hpd().shape == (2, 2, 2)
+    assert_array_almost_equal(merged.quantile(0.5), np.median(ary, axis=0), 1)
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(error=0.01).update(ary))
+
+
+def test_summary_approx(centered_eight):
+    exact = summary(centered_eight)
+    approx = summary(centered_eight, method="approx")
+    assert list(approx.columns) == list(exact.columns)
+    assert np.all(np.abs(approx["hpd 3%"] - exact["hpd 3%"]) < exact["sd"])
+    assert np.all(np.abs(approx["hpd 97%"] - exact["hpd 97%"]) < exact["sd"])
+    with pytest.raises(ValueError):
+        summary(centered_eight, method="bad_method")
+
+
 def test_hpd_bad_ci():
     normal_sample = np.random.randn(10)
     with pytest.raises(ValueError):
@@ -84,6 +151,22 @@ def test_compare_different(centered_eight, non_centered_eight, ic, method, scale
     assert_almost_equal(np.sum(weight), 1.0)
 
 
+@pytest.mark.parametrize("ic", ["waic", "loo"])
+def test_compare_stacking_log_space(centered_eight, non_centered_eight, ic):
+    """The stacking weights do not change when all the predictive densities underflow."""
+    model_dict = {"centered": centered_eight, "non_centered": non_centered_eight}
+    expected = compare(model_dict, ic=ic, method="stacking")["weight"]
+    shifted_dict = {}
+    for name, data in model_dict.items():
+        shifted_dict[name] = deepcopy(data)
+        shifted_dict[name].sample_stats["log_likelihood"] -= 1000
+    weight = compare(shifted_dict, ic=ic, method="stacking")["weight"]
+    assert_almost_equal(np.sum(weight), 1.0)
+    assert_array_almost_equal(
+        weight[expected.index].astype(float), expected.astype(float), decimal=3
+    )
+
+
 def test_compare_different_size(centered_eight, non_centered_eight):
     centered_eight = deepcopy(centered_eight)
     centered_eight.posterior = centered_eight.posterior.drop("Choate", "school")
@@ -139,6 +222,172 @@ def test_summary_unpack_order(order):
                     column_order.append("a[{},{},{}]".format(idx3, idx2, idx1))
     for col1, col2 in zip(list(az_summary.index), column_order):
         assert col1 == col2
+    ary = data.posterior.a.values
+    assert_almost_equal(az_summary.loc["a[1,2,0]", "mean"], ary[:, :, 1, 2, 0].mean(), 2)
+
+
+@pytest.mark.parametrize("include_circ", [True, False])
+def test_summary_n_jobs(centered_eight, include_circ):
+    summary_df = summary(centered_eight, include_circ=include_circ, stat_funcs=[np.var], n_jobs=3)
+    assert summary_df.equals(
+        summary(centered_eight, include_circ=include_circ, stat_funcs=[np.var])
+    )
+
+
+def test_summary_dask(centered_eight):
+    pytest.importorskip("dask")
+    chunked = centered_eight.posterior.chunk({"school": 3, "draw": 100})
+    assert summary(chunked).equals(summary(centered_eight))
+    assert summary(chunked, fmt="xarray").theta.chunks is not None
+
+
+def test_summary_matches_functions(centered_eight):
+    summary_df = summary(centered_eight, include_circ=True, round_to=None)
+    theta = centered_eight.posterior.theta.values
+    samples = theta.reshape(-1, theta.shape[-1])
+    row = "theta[{}]".format(theta.shape[-1] - 1)
+    assert_almost_equal(summary_df.loc[row, "mean"], samples[:, -1].mean())
+    assert_almost_equal(summary_df.loc[row, "sd"], samples[:, -1].std())
+    assert_almost_equal(summary_df.loc[row, "mc error"], _mc_error(samples[:, -1]))
+    assert_array_almost_equal(
+        summary_df.loc[row, ["hpd 3%", "hpd 97%"]].values.astype(float), hpd(samples[:, -1])
+    )
+    assert_array_almost_equal(
+        summary_df.loc[row, ["circular hpd 3.00%", "circular hpd 97.00%"]].values.astype(float),
+        hpd(samples[:, -1], circular=True),
+    )
+    assert_almost_equal(
+        summary_df.loc[row, "circular mc error"], _mc_error(samples[:, -1], circular=True)
+    )
+    assert_almost_equal(summary_df.loc[row, "r_hat"], rhat(theta[..., -1]))
+
+
+def test_incremental_summary(centered_eight):
+    posterior = centered_eight.posterior
+    # with all the lags tracked, the effective sample size is exact
+    incremental = IncrementalSummary(
+        posterior.isel(draw=slice(0, 200)), var_names=["mu", "theta"], max_lag=posterior.draw.size
+    )
+    incremental.update(posterior.isel(draw=slice(200, 350)))
+    incremental.update(posterior.isel(draw=slice(350, None)))
+    result = incremental.summary(round_to=None, include_hpd=True)
+    expected = summary(centered_eight, var_names=["mu", "theta"], round_to=None)
+    assert list(result.columns) == list(expected.columns)
+    for metric in ("mean", "sd", "hpd 3%", "hpd 97%", "ess", "r_hat"):
+        assert_array_almost_equal(result[metric], expected[metric])
+    ess_mcse = summary(centered_eight, var_names=["mu", "theta"], round_to=None, mcse_method="ess")
+    assert_array_almost_equal(result["mc error"], ess_mcse["mc error"])
+    assert "hpd 3%" not in incremental.summary().columns
+    # mean, sd, mc error, ess and r_hat
+    assert incremental.summary(fmt="xarray").theta.shape == (5, 8)
+    assert incremental.summary(fmt="xarray", include_hpd=True).theta.shape == (7, 8)
+
+
+def test_incremental_summary_one_chain(centered_eight):
+    posterior = centered_eight.posterior.isel(chain=[0])
+    incremental = IncrementalSummary(posterior, var_names=["mu"], max_lag=posterior.draw.size)
+    result = incremental.summary(round_to=None)
+    assert list(result.columns) == ["mean", "sd", "mc error"]
+    draws = posterior.mu.values
+    acov = _autocov(draws, axis=-1)[None]
+    ess = _ess_from_acov(acov, draws.mean(axis=-1)[None], draws.shape[-1])[0]
+    assert_almost_equal(result.loc["mu", "mc error"], draws.std() / np.sqrt(ess))
+    with pytest.raises(TypeError):
+        incremental.effective_sample_size()
+
+
+def test_incremental_summary_no_draws(centered_eight):
+    incremental = IncrementalSummary(keep_draws=False)
+    with pytest.raises(ValueError):
+        incremental.summary()
+    incremental.update(centered_eight)
+    with pytest.raises(ValueError):
+        incremental.summary(include_hpd=True)
+
+
+def test_summary_mcse_method(centered_eight):
+    batch = summary(centered_eight, round_to=None)
+    ess = summary(centered_eight, round_to=None, mcse_method="ess")
+    assert_array_almost_equal(ess["mc error"], ess["sd"] / np.sqrt(ess["ess"]))
+    overlapping = summary(centered_eight, round_to=None, mcse_method="overlapping")
+    assert np.all(overlapping["mc error"] > 0)
+    assert_array_almost_equal(overlapping["mean"], batch["mean"])
+    with pytest.raises(ValueError):
+        summary(centered_eight, mcse_method="bad_method")
+
+
+def test_summary_round_to_none(centered_eight):
+    summary_df = summary(centered_eight, round_to=None)
+    assert_almost_equal(summary_df.loc["mu", "mean"], centered_eight.posterior.mu.mean())
+
+
+def test_cache(centered_eight, tmpdir):
+    enable_cache(maxsize=2, path=str(tmpdir.join("cache")))
+    try:
+        summary_df = summary(centered_eight)
+        assert summary(deepcopy(centered_eight)).equals(summary_df)
+        # results are copied in and out of the cache
+        summary(centered_eight).loc["mu", "mean"] = np.inf
+        assert summary(centered_eight).equals(summary_df)
+        loo_data = loo(centered_eight)
+        waic(centered_eight)
+        store = cache._CACHE["store"]  # pylint: disable=protected-access
+        assert len(store.results) == 2
+        # evicted from memory but persisted on disk
+        assert summary(centered_eight).equals(summary_df)
+        modified = deepcopy(centered_eight)
+        modified.sample_stats["log_likelihood"] += 1
+        assert loo(modified).loo != loo_data.loo
+        clear_cache()
+        assert not store.results
+    finally:
+        disable_cache()
+
+
+@pytest.fixture(scope="module")
+def netcdf_paths(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp("diagnose_many")
+    paths = []
+    for idx in range(3):
+        data = from_dict(
+            posterior={"mu": np.random.randn(4, 200), "theta": np.random.randn(4, 200, 3)},
+            sample_stats={"log_likelihood": np.random.randn(4, 200, 5)},
+        )
+        path = str(tmpdir.join("fit_{}.nc".format(idx)))
+        data.to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def test_diagnose_many(netcdf_paths):
+    diagnostics = diagnose_many(netcdf_paths, ["summary", "rhat", "loo"], var_names=["theta"])
+    assert list(diagnostics.columns) == ["file", "variable", "metric", "value"]
+    assert list(diagnostics.file.unique()) == netcdf_paths
+    assert set(diagnostics.variable) == {"theta[0]", "theta[1]", "theta[2]", "log_likelihood"}
+    rhat_rows = diagnostics[(diagnostics.file == netcdf_paths[1]) & (diagnostics.metric == "rhat")]
+    expected = rhat(from_netcdf(netcdf_paths[1])).theta.values
+    assert_array_almost_equal(rhat_rows.value.values.astype(float), expected)
+    with pytest.raises(ValueError):
+        diagnose_many(netcdf_paths, ["bad"])
+
+
+def test_diagnose_many_loo_skips_posterior(netcdf_paths, monkeypatch):
+    read_groups = []
+    load_netcdf_group = stats_module._load_netcdf_group
+
+    def _load(path, group, var_names=None):
+        read_groups.append(group)
+        return load_netcdf_group(path, group, var_names)
+
+    monkeypatch.setattr(stats_module, "_load_netcdf_group", _load)
+    diagnostics = diagnose_many(netcdf_paths, ["loo"])
+    assert set(diagnostics.metric) == {"loo", "loo_se", "p_loo", "warning"}
+    assert read_groups == ["sample_stats"] * len(netcdf_paths)
+
+
+def test_diagnose_many_n_jobs(netcdf_paths):
+    diagnostics = diagnose_many(netcdf_paths, ["ess", "loo"])
+    assert diagnostics.equals(diagnose_many(netcdf_paths, ["ess", "loo"], n_jobs=2))
 
 
 @pytest.mark.parametrize(
@@ -150,6 +399,22 @@ def test_summary_stat_func(centered_eight, stat_funcs):
     assert hasattr(arviz_summary, "var")
 
 
+@pytest.mark.parametrize("fmt", ["wide", "xarray"])
+def test_summary_stat_func_values(centered_eight, fmt):
+    """The statistics of stat_funcs are not mixed up with the default ones."""
+    expected = summary(centered_eight, fmt=fmt, round_to=None)
+    result = summary(centered_eight, fmt=fmt, round_to=None, stat_funcs=[np.median])
+    if fmt == "xarray":
+        assert result.theta.dims == ("metric", "school")
+        xr.testing.assert_allclose(result.sel(metric=expected.metric), expected)
+        median = result.sel(metric="median", drop=True)
+        xr.testing.assert_allclose(median, centered_eight.posterior.median(("chain", "draw")))
+    else:
+        assert_array_almost_equal(result[expected.columns].values, expected.values)
+        theta = centered_eight.posterior.theta.values.reshape((-1, 8))
+        assert_array_almost_equal(result.loc["theta[0]":"theta[7]", "median"], np.median(theta, 0))
+
+
 def test_summary_nan(centered_eight):
     centered_eight = deepcopy(centered_eight)
     centered_eight.posterior.theta[:, :, 0] = np.nan
@@ -216,6 +481,19 @@ def test_loo(centered_eight):
     assert loo(centered_eight) is not None
 
 
+def test_loo_waic_float32(centered_eight):
+    """float32 log likelihoods are accumulated in double precision"""
+    centered_eight_32 = deepcopy(centered_eight)
+    log_likelihood = centered_eight_32.sample_stats.log_likelihood
+    centered_eight_32.sample_stats["log_likelihood"] = log_likelihood.astype(np.float32)
+    centered_eight_64 = deepcopy(centered_eight_32)
+    centered_eight_64.sample_stats["log_likelihood"] = log_likelihood.astype(np.float32).astype(
+        np.float64
+    )
+    assert_almost_equal(loo(centered_eight_32).loo, loo(centered_eight_64).loo, decimal=4)
+    assert_almost_equal(waic(centered_eight_32).waic, waic(centered_eight_64).waic, decimal=4)
+
+
 def test_loo_one_chain(centered_eight):
     centered_eight = deepcopy(centered_eight)
     centered_eight.posterior = centered_eight.posterior.drop([1, 2, 3], "chain")
@@ -261,6 +539,106 @@ def test_loo_warning(centered_eight):
         assert loo(centered_eight, pointwise=True) is not None
 
 
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_loo_waic_chunks(centered_eight, chunk_size):
+    for func, pointwise_name in ((loo, "loo_i"), (waic, "waic_i")):
+        expected = func(centered_eight, pointwise=True)
+        result = func(centered_eight, pointwise=True, chunk_size=chunk_size)
+        assert_array_almost_equal(result[pointwise_name], expected[pointwise_name])
+        assert_almost_equal(result[func.__name__], expected[func.__name__])
+        assert_almost_equal(result["p_" + func.__name__], expected["p_" + func.__name__])
+    with pytest.raises(ValueError):
+        loo(centered_eight, chunk_size=0)
+
+
+def test_loo_reff(centered_eight, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("loo must not compute the ess of the posterior")
+
+    monkeypatch.setattr(stats_module, "effective_sample_size", fail)
+    pointwise = loo(centered_eight, pointwise=True)
+    assert loo(centered_eight, reff="mean") is not None
+    assert_array_almost_equal(
+        loo(centered_eight, pointwise=True, chunk_size=3)["loo_i"], pointwise["loo_i"]
+    )
+    with pytest.raises(ValueError):
+        loo(centered_eight, reff="bad_value")
+
+
+def test_loo_store_psis(centered_eight, tmpdir, monkeypatch):
+    data = deepcopy(centered_eight)
+    expected = loo(data, pointwise=True, scale="log")
+    assert loo(data, pointwise=True, scale="log", store_psis=True).equals(expected)
+    assert "psis" in data._groups  # pylint: disable=protected-access
+    assert_array_almost_equal(data.psis.pareto_k, expected.pareto_k)
+
+    filepath = data.to_netcdf(str(tmpdir.join("psis.nc")))
+    data = from_netcdf(filepath)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("stored PSIS results must be reused")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(stats_module, "psislw", fail)
+        result = loo(data, pointwise=True, scale="log", chunk_size=3)
+        assert_array_almost_equal(result.loo_i, expected.loo_i)
+        assert_almost_equal(result.p_loo, expected.p_loo)
+        assert_almost_equal(loo(data).loo, -2 * expected.loo)
+        assert compare({"model": data}, ic="loo") is not None
+        with pytest.raises(AssertionError):
+            loo(data, reff="mean")
+
+    modified = deepcopy(centered_eight)
+    modified.sample_stats["log_likelihood"] += 1
+    modified.psis = data.psis
+    assert loo(modified).loo != loo(data).loo
+    with pytest.raises(TypeError):
+        loo(data.sample_stats.log_likelihood.values, store_psis=True)
+
+
+@pytest.mark.parametrize("approximation", ["lppd", "waic"])
+def test_loo_subsample_all_observations(centered_eight, approximation):
+    expected = loo(centered_eight)
+    result = loo_subsample(centered_eight, observations=8, approximation=approximation)
+    assert result.subsample_size == 8
+    assert_almost_equal(result.loo_subsampling_se, 0)
+    assert_almost_equal(result.loo, expected.loo)
+    assert_almost_equal(result.loo_se, expected.loo_se)
+    assert_almost_equal(result.p_loo, expected.p_loo)
+
+
+def test_loo_subsample():
+    log_likelihood = -np.exp(np.random.randn(1, 500)) + 0.3 * np.random.randn(2, 200, 500)
+    data = from_dict(
+        posterior={"mu": np.random.randn(2, 200)}, sample_stats={"log_likelihood": log_likelihood}
+    )
+    expected = loo(data)
+    result = loo_subsample(data, observations=50, approximation="waic", seed=0)
+    assert result.subsample_size == 50
+    assert 0 < result.loo_subsampling_se
+    assert abs(result.loo - expected.loo) < 5 * result.loo_subsampling_se
+    assert_almost_equal(result.loo_se / expected.loo_se, 1, decimal=0)
+
+    target_se = result.loo_subsampling_se / 2
+    grown = loo_subsample(data, observations=50, approximation="waic", target_se=target_se, seed=0)
+    assert grown.subsample_size > 50
+    assert grown.loo_subsampling_se <= target_se or grown.subsample_size == 500
+    with pytest.raises(ValueError):
+        loo_subsample(data, approximation="bad_value")
+    with pytest.raises(ValueError):
+        loo_subsample(data, observations=1)
+
+
+def test_psislw_reff_array():
+    log_weights = np.random.standard_t(3, size=(1000, 6)) * 2
+    reff = np.array([0.1, 0.5, 1.0, 0.1, 2.0, 0.5])
+    lw_out, kss = psislw(log_weights, reff)
+    for col, col_reff in enumerate(reff):
+        col_lw, col_k = psislw(log_weights[:, [col]], col_reff)
+        assert_almost_equal(lw_out[:, col], col_lw[:, 0])
+        assert_almost_equal(kss[col], col_k[0])
+
+
 def test_psislw():
     data = load_arviz_data("centered_eight")
     pareto_k = loo(data, pointwise=True, reff=0.7)["pareto_k"]
@@ -271,6 +649,27 @@ def test_psislw():
     assert_almost_equal(pareto_k, psislw(-log_likelihood, 0.7)[1])
 
 
+def test_psislw_blocks(monkeypatch):
+    monkeypatch.setattr(kernels, "NUMBA_AVAILABLE", False)
+    log_weights = np.random.standard_t(3, size=(1000, 20)) * 2
+    log_weights[:, 0] = 0
+    lw_out, kss = psislw(log_weights)
+    monkeypatch.setattr(stats_module, "_PSIS_BLOCK_ELEMENTS", 3000)
+    lw_blocks, kss_blocks = psislw(log_weights)
+    assert_almost_equal(lw_blocks, lw_out)
+    assert_almost_equal(kss_blocks, kss)
+    assert np.isinf(kss[0])
+
+
+def test_gpdfit_columns():
+    x = np.sort(np.random.pareto(2, size=(50, 4)), axis=0)
+    k_ary, sigma_ary = _gpdfit(x)
+    for col in range(4):
+        k, sigma = _gpdfit(x[:, col])
+        assert_almost_equal(k_ary[col], k)
+        assert_almost_equal(sigma_ary[col], sigma)
+
+
 @pytest.mark.parametrize("size", [100, 101])
 @pytest.mark.parametrize("batches", [1, 2, 3, 5, 7])
 @pytest.mark.parametrize("ndim", [1, 2, 3])
@@ -280,6 +679,33 @@ def test_mc_error(size, batches, ndim, circular):
     assert _mc_error(x, batches=batches, circular=circular) is not None
 
 
+@pytest.mark.parametrize("size", [100, 101])
+@pytest.mark.parametrize("batches", [2, 3, 5])
+def test_mc_error_overlapping(size, batches):
+    x = np.random.randn(size, 3)
+    batch_len = size // batches
+    mc_error = _mc_error(x, batches=batches, method="overlapping")
+    for col in range(3):
+        window_means = np.array(
+            [x[start : start + batch_len, col].mean() for start in range(size - batch_len + 1)]
+        )
+        variance = (
+            size
+            * batch_len
+            / ((size - batch_len) * len(window_means))
+            * np.sum((window_means - x[:, col].mean()) ** 2)
+        )
+        assert_almost_equal(mc_error[col], np.sqrt(variance / size))
+    assert_almost_equal(mc_error[0], _mc_error(x[:, 0], batches=batches, method="overlapping"))
+    with pytest.raises(ValueError):
+        _mc_error(x, circular=True, method="overlapping")
+
+
+def test_mc_error_transposed_view():
+    x = np.random.randn(3, 103)
+    assert_almost_equal(_mc_error(x.T), [_mc_error(row) for row in x])
+
+
 @pytest.mark.parametrize("probs", [True, False])
 @pytest.mark.parametrize("kappa", [-1, -0.5, 1e-30, 0.5, 1])
 @pytest.mark.parametrize("sigma", [0, 2])